@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import random
+import numpy as np
+import multiprocessing
+from learner import Learner
+from checkpoint import Checkpointer
+from metrics import Metrics
+from ms_pacman import MsPacManGame
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+class ActorPool(object):
+
+    """Pool of emulator and learner processes sharing the same weights.
+
+    Every worker plays its own game with its own seed. The weights live in
+    shared memory and are either updated in place by every worker without
+    locking, or updated locally and periodically averaged into the shared
+    weights. The exploration probability is shared as well, so that it
+    decays with the total number of updates of all workers.
+    """
+
+    ASYNC = "async"
+    AVERAGE = "average"
+    MODES = (ASYNC, AVERAGE)
+
+    # Number of updates in between reports of a worker's progress, so that
+    # checkpoints can be saved in the middle of episodes.
+    REPORT_INTERVAL = 100
+
+    def __init__(self, workers, agent, mode=ASYNC, sync_interval=100,
+                 learn=True, incremental_map=False, cache_size=0,
+                 rerandomize=False):
+        """Constructs an ActorPool.
+
+        Args:
+            workers: Number of worker processes.
+            agent: Learner to take the initial weights and hyperparameters
+                from, and to keep in sync with the shared weights.
+            mode: ASYNC or AVERAGE.
+            sync_interval: Number of updates in between averaging the
+                weights of a worker into the shared weights.
+            learn: Whether to train or not.
+            incremental_map: Whether games update their maps incrementally.
+            cache_size: Number of state utilities each worker caches.
+            rerandomize: Whether games keep the emulator's randomness going
+                across episodes instead of replaying their first one's.
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown weight synchronization mode: {}"
+                             .format(mode))
+
+        self.workers = workers
+        self.agent = agent
+        self.mode = mode
+        self.sync_interval = sync_interval
+        self.learn = learn
+        self.incremental_map = incremental_map
+        self.rerandomize = rerandomize
+
+        # Updates made by other workers in place do not bump a worker's
+        # weights version, so cached utilities could go stale.
+        if learn and mode == self.ASYNC:
+            cache_size = 0
+        self.cache_size = cache_size
+
+        self._weights = multiprocessing.Array("d", len(agent.weights))
+        self._glie = multiprocessing.Value("d", agent.glie)
+        self.shared_weights[:] = agent.weights
+
+    @property
+    def shared_weights(self):
+        """Weights in shared memory."""
+        return np.frombuffer(self._weights.get_obj())
+
+    def run(self, episodes, seed=None, checkpointer=None, metrics=None,
+            quiet=False):
+        """Plays episodes across all workers.
+
+        The agent is updated with the shared weights and the workers'
+        number of updates whenever they report, and checkpointed as the
+        checkpointer sees fit and whenever an episode completes if learning.
+
+        Args:
+            episodes: Total number of episodes to play.
+            seed: Seed of the first worker, the others use the following
+                ones. Randomized when None.
+            checkpointer: Checkpointer of the agent, one with the default
+                retention and no periodic checkpoints by default.
+            metrics: Metrics to record the completed episodes to, printing
+                them to the console by default.
+            quiet: Whether not to print the workers' progress.
+
+        Returns:
+            List of (worker, episode, score) tuples in order of completion.
+        """
+        if seed is None:
+            seed = random.randint(0, 255)
+        if checkpointer is None:
+            checkpointer = Checkpointer(self.agent)
+        if metrics is None:
+            metrics = Metrics()
+
+        results = multiprocessing.Queue()
+        processes = []
+        for worker in range(self.workers):
+            worker_episodes = episodes // self.workers
+            if worker < episodes % self.workers:
+                worker_episodes += 1
+            if not worker_episodes:
+                continue
+            process = multiprocessing.Process(
+                target=self._run_worker,
+                args=(worker, seed + worker, worker_episodes, results))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        scores = []
+        while len(scores) < episodes:
+            try:
+                worker, episode, score, steps, updates = \
+                    results.get(timeout=1)
+            except Empty:
+                if not any(process.is_alive() for process in processes):
+                    print("All workers exited early")
+                    break
+                if self.learn:
+                    # Periodic checkpoints may be due by now.
+                    self.sync_agent()
+                    checkpointer.step(0)
+                continue
+
+            self.agent.steps += updates
+            if episode is None:
+                # Progress in the middle of an episode.
+                if self.learn:
+                    self.sync_agent()
+                    checkpointer.step(updates)
+                continue
+
+            scores.append((worker, episode, score))
+            self.agent.episodes += 1
+            metrics.episode(score, steps)
+            if not quiet:
+                print("Worker {} episode {}, GLIE: {}".format(
+                    worker, episode + 1, self._glie.value))
+            if self.learn:
+                self.sync_agent()
+                checkpointer.save()
+
+        for process in processes:
+            process.join()
+        return scores
+
+    def sync_agent(self, agent=None):
+        """Copies the shared weights and GLIE into an agent.
+
+        Args:
+            agent: Learner to update, the pool's own agent by default.
+        """
+        if agent is None:
+            agent = self.agent
+        with self._weights.get_lock():
+            agent.weights[:] = self.shared_weights
+        agent.glie = self._glie.value
+        agent.weights_version += 1
+
+    def _run_worker(self, worker, seed, episodes, results):
+        """Plays episodes in a worker process.
+
+        Args:
+            worker: Index of the worker.
+            seed: Seed of the worker.
+            episodes: Number of episodes to play.
+            results: Queue to report (worker, episode, score, number of
+                steps, number of updates) tuples to, at the end of every
+                episode and every REPORT_INTERVAL updates in between, with
+                None as the episode and score.
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+
+        agent = Learner(self.agent.alpha, self.agent.gamma, self.cache_size,
+                        distance_features=self.agent.distance_features,
+                        radius=self.agent.radius)
+        if self.mode == self.ASYNC:
+            agent.weights = self.shared_weights
+        else:
+            self.sync_agent(agent)
+        anchor = agent.weights.copy()
+
+        game = MsPacManGame(seed, False, self.incremental_map,
+                            radius=agent.radius)
+        updates = 0
+        reported_updates = 0
+        for episode in range(episodes):
+            steps = 0
+            while not game.game_over():
+                prev_state = game.sliced_map.map
+                optimal_a, expected_utility = agent.get_optimal_action(game)
+                reward = game.act(optimal_a)
+                steps += 1
+
+                if not self.learn:
+                    continue
+
+                agent.update_weights(prev_state, optimal_a, game,
+                                     expected_utility, reward)
+                with self._glie.get_lock():
+                    self._glie.value = Learner.decay_glie(self._glie.value)
+                    agent.glie = self._glie.value
+
+                updates += 1
+                if (self.mode == self.AVERAGE and
+                        updates % self.sync_interval == 0):
+                    self._average(agent, anchor)
+                if updates - reported_updates >= self.REPORT_INTERVAL:
+                    results.put((worker, None, None, 0,
+                                 updates - reported_updates))
+                    reported_updates = updates
+
+            if self.learn and self.mode == self.AVERAGE:
+                self._average(agent, anchor)
+            results.put((worker, episode, game.reward, steps,
+                         updates - reported_updates))
+            reported_updates = updates
+            game.reset_game(self.rerandomize)
+
+    def _average(self, agent, anchor):
+        """Averages a worker's updates into the shared weights.
+
+        Each worker contributes the mean of its updates since it last
+        synchronized, which amounts to averaging the weights of all workers
+        when they synchronize together.
+
+        Args:
+            agent: Learner of the worker.
+            anchor: Weights of the worker when it last synchronized, updated
+                in place.
+        """
+        with self._weights.get_lock():
+            shared_weights = self.shared_weights
+            shared_weights += (agent.weights - anchor) / self.workers
+            agent.weights[:] = shared_weights
+            anchor[:] = shared_weights
+        agent.weights_version += 1
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import numpy as np
+from learner import Learner
+from map_proc import get_slice
+from ms_pacman import MsPacManGame
+from game_map import GameMap, SlicedGameMap, WallLayoutCache
+from fake_ale import (FakeALEInterface, RecordingALEInterface, load_fixture,
+                      make_synthetic_fixture)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+DEFAULT_FIXTURE = os.path.join(FIXTURES_DIR, "synthetic.npz")
+DEFAULT_BASELINE = os.path.join(FIXTURES_DIR, "baseline.json")
+
+# Minimum number of seconds each benchmark runs for by default, repeating it
+# as needed, since shorter timings are mostly noise.
+MIN_SECONDS = 3.0
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class _BenchmarkLearner(Learner):
+
+    """Learner starting from the default weights, ignoring saved ones."""
+
+    # None of these exist.
+    CHECKPOINT_PREFIX = os.path.join(FIXTURES_DIR, "no-checkpoint")
+    WEIGHTS_FILE = os.path.join(FIXTURES_DIR, "no-weights.p")
+    GLIE_FILE = os.path.join(FIXTURES_DIR, "no-glie.p")
+
+
+def _seed(seed=0):
+    """Seeds the random number generators."""
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+# Transitions of every fixture played so far, see _get_transitions().
+_transitions = {}
+
+
+def _get_transitions(fixture, count=200):
+    """Plays the fixture through to capture transitions to benchmark on.
+
+    The transitions of a fixture are only played once, so that repeated
+    benchmark runs only spend time on what they measure.
+
+    Args:
+        fixture: Fixture loaded by load_fixture().
+        count: Maximum number of transitions.
+
+    Returns:
+        List of (state before, action, expected utility, state after,
+        reward) tuples, with GameStates.
+    """
+    key = id(fixture)
+    if key not in _transitions:
+        _seed()
+        game = MsPacManGame(0, False, ale=FakeALEInterface(fixture))
+        agent = _BenchmarkLearner()
+        transitions = []
+        while not game.game_over() and len(transitions) < count:
+            state = game.freeze()
+            action, expected_utility = agent.get_optimal_action(game)
+            reward = game.act(action)
+            transitions.append((state, action, expected_utility,
+                                game.freeze(), reward))
+        _transitions[key] = transitions
+    return _transitions[key]
+
+
+def bench_classify(fixture):
+    """Classifies every screen of the fixture from scratch.
+
+    Returns:
+        Tuple of (number of screens, seconds).
+    """
+    screens = fixture["screens"]
+    start = _clock()
+    for screen in screens:
+        GameMap(screen)
+    return len(screens), _clock() - start
+
+
+def bench_classify_cached(fixture):
+    """Classifies every screen of the fixture with a wall layout cache.
+
+    Returns:
+        Tuple of (number of screens, seconds).
+    """
+    screens = fixture["screens"]
+    wall_cache = WallLayoutCache()
+    start = _clock()
+    for screen in screens:
+        GameMap(screen, wall_cache=wall_cache)
+    return len(screens), _clock() - start
+
+
+def bench_slice(fixture):
+    """Slices the first map of the fixture around every position.
+
+    Returns:
+        Tuple of (number of slices, seconds).
+    """
+    game_map = GameMap(fixture["screens"][0])
+    positions = [
+        (i, j) for i in range(GameMap.HEIGHT) for j in range(GameMap.WIDTH)
+    ]
+    # Only the steady state matters, not building the tables of the maze.
+    get_slice(game_map, positions[0], SlicedGameMap.RADIUS)
+    start = _clock()
+    for position in positions:
+        get_slice(game_map, position, SlicedGameMap.RADIUS)
+    return len(positions), _clock() - start
+
+
+def bench_select(fixture):
+    """Selects actions from states along the fixture.
+
+    Returns:
+        Tuple of (number of decisions, seconds).
+    """
+    transitions = _get_transitions(fixture)
+    agent = _BenchmarkLearner()
+    _seed()
+    start = _clock()
+    for state, _, _, _, _ in transitions:
+        agent.get_optimal_action(state)
+    return len(transitions), _clock() - start
+
+
+def bench_update(fixture):
+    """Updates the weights from transitions along the fixture.
+
+    Returns:
+        Tuple of (number of updates, seconds).
+    """
+    transitions = _get_transitions(fixture)
+    agent = _BenchmarkLearner()
+    _seed()
+    start = _clock()
+    for state, action, expected_utility, next_state, reward in transitions:
+        agent.update_weights(state.sliced_map.map, action, next_state,
+                             expected_utility, reward)
+    return len(transitions), _clock() - start
+
+
+def bench_episode(fixture):
+    """Plays and learns from the whole fixture as an episode.
+
+    Returns:
+        Tuple of (number of decisions, seconds).
+    """
+    _seed()
+    start = _clock()
+    game = MsPacManGame(0, False, ale=FakeALEInterface(fixture))
+    agent = _BenchmarkLearner()
+    decisions = 0
+    while not game.game_over():
+        prev_state = game.sliced_map.map
+        action, expected_utility = agent.get_optimal_action(game)
+        reward = game.act(action)
+        agent.update_weights(prev_state, action, game, expected_utility,
+                             reward)
+        decisions += 1
+    return decisions, _clock() - start
+
+
+def bench_reference(fixture):
+    """Runs a fixed mix of Python and small NumPy operations.
+
+    It does not depend on the agent's code, so that the other benchmarks can
+    be measured relative to it and compare across machines of different
+    speeds.
+
+    Returns:
+        Tuple of (number of operations, seconds).
+    """
+    matrix = np.random.RandomState(0).randint(0, 8, (14, 20))
+    operations = 1000
+    start = _clock()
+    total = 0
+    for k in range(operations):
+        total += int(np.count_nonzero(matrix == k % 8))
+        total += sum(i * i for i in range(32))
+    return operations, _clock() - start
+
+
+BENCHMARKS = [
+    ("classify", bench_classify),
+    ("classify_cached", bench_classify_cached),
+    ("slice", bench_slice),
+    ("select", bench_select),
+    ("update", bench_update),
+    ("episode", bench_episode)
+]
+
+
+def _measure(benchmark, fixture, seconds):
+    """Measures the speed of a benchmark relative to bench_reference().
+
+    The load of the machine may change from one moment to the next, so each
+    run of the benchmark is compared to runs of the reference right before
+    and after it, and the median of these ratios is kept.
+
+    Args:
+        benchmark: Benchmark function.
+        fixture: Fixture loaded by load_fixture().
+        seconds: Minimum number of seconds to run the benchmark for.
+
+    Returns:
+        Tuple of (operations per second, speed relative to
+        bench_reference()).
+    """
+    total_operations = 0
+    total_elapsed = 0.0
+    ratios = []
+    operations, elapsed = bench_reference(fixture)
+    before = operations / elapsed
+    while total_elapsed < seconds:
+        operations, elapsed = benchmark(fixture)
+        total_operations += operations
+        total_elapsed += elapsed
+        reference_operations, reference_elapsed = bench_reference(fixture)
+        after = reference_operations / reference_elapsed
+        ratios.append(2 * operations / elapsed / (before + after))
+        before = after
+    return total_operations / total_elapsed, float(np.median(ratios))
+
+
+def run(fixture, names=None, seconds=MIN_SECONDS):
+    """Runs benchmarks.
+
+    Args:
+        fixture: Fixture loaded by load_fixture().
+        names: Names of the benchmarks to run, all of them by default.
+        seconds: Minimum number of seconds to run each benchmark for.
+
+    Returns:
+        Tuple of (dictionary of benchmark name to operations per second,
+        dictionary of benchmark name to speed relative to
+        bench_reference()).
+    """
+    results = {}
+    relative_results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results[name], relative_results[name] = _measure(benchmark, fixture,
+                                                         seconds)
+    return results, relative_results
+
+
+def compare(results, relative_results, baseline, threshold):
+    """Compares results against a baseline.
+
+    Args:
+        results: Dictionary of benchmark name to operations per second.
+        relative_results: Dictionary of benchmark name to speed relative to
+            bench_reference().
+        baseline: Dictionary of benchmark name to speed relative to
+            bench_reference().
+        threshold: Maximum slowdown ratio, e.g. 0.2 for 20% slower.
+
+    Returns:
+        List of the names of the benchmarks that regressed.
+    """
+    regressions = []
+    print("{:<16} {:>12} {:>10} {:>10} {:>8}".format(
+        "benchmark", "ops/s", "relative", "baseline", "change"))
+    for name, _ in BENCHMARKS:
+        if name not in results:
+            continue
+        relative = relative_results[name]
+        line = "{:<16} {:>12.1f} {:>10.4f}".format(name, results[name],
+                                                   relative)
+        if name in baseline:
+            change = relative / baseline[name] - 1
+            line += " {:>10.4f} {:>+7.1%}".format(baseline[name], change)
+            if change < -threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def get_platform():
+    """Describes the platform benchmarks run on, to tell baselines apart.
+
+    Relative speeds still depend on the architecture and Python version,
+    but not on the host.
+
+    Returns:
+        Architecture and Python version.
+    """
+    return "{} Python {}.{}".format(platform.machine(),
+                                    *platform.python_version_tuple()[:2])
+
+
+def load_baselines(path):
+    """Loads the baselines of every platform.
+
+    Args:
+        path: Path of the baselines.
+
+    Returns:
+        Dictionary of platform to dictionary of benchmark name to speed
+        relative to bench_reference().
+    """
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path, baselines):
+    """Saves the baselines of every platform.
+
+    Args:
+        path: Path of the baselines.
+        baselines: Dictionary of platform to dictionary of benchmark name to
+            speed relative to bench_reference().
+    """
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def record(path, seed):
+    """Records a fixture from the Arcade Learning Environment.
+
+    Args:
+        path: Path of the .npz file to write.
+        seed: Random seed of the emulator.
+    """
+    from ale_python_interface import ALEInterface
+    recorder = RecordingALEInterface(ALEInterface())
+    game = MsPacManGame(seed, False, ale=recorder)
+    agent = Learner(read_only=True)
+    while not game.game_over():
+        game.act(agent.get_optimal_action(game)[0])
+    recorder.save(path)
+
+
+def get_args():
+    """Gets parsed command-line arguments.
+
+    Returns:
+        Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="benchmarks the agent on recorded frames")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE,
+                        help="fixture to replay")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baselines to compare against, by platform")
+    parser.add_argument("--threshold", default=0.2, type=float,
+                        help="maximum slowdown against the baseline before "
+                             "failing, e.g. 0.2 for 20%% slower")
+    parser.add_argument("--seconds", default=MIN_SECONDS, type=float,
+                        help="minimum number of seconds to run each "
+                             "benchmark for")
+    parser.add_argument("--only", nargs="+", default=None,
+                        choices=[name for name, _ in BENCHMARKS],
+                        help="benchmarks to run")
+    parser.add_argument("--update-baseline", action="store_true",
+                        default=False,
+                        help="store the results as the new baseline of this "
+                             "platform")
+    parser.add_argument("--record", default=None, metavar="PATH",
+                        help="record a fixture from the Arcade Learning "
+                             "Environment instead")
+    parser.add_argument("--generate", default=None, metavar="PATH",
+                        help="generate a synthetic fixture instead")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="seed to record or generate a fixture with")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.record:
+        record(args.record, args.seed)
+        sys.exit(0)
+    if args.generate:
+        make_synthetic_fixture(args.generate, seed=args.seed)
+        sys.exit(0)
+
+    results, relative_results = run(load_fixture(args.fixture), args.only,
+                                    args.seconds)
+
+    baselines = load_baselines(args.baseline)
+    key = get_platform()
+    baseline = baselines.get(key, {})
+    regressions = compare(results, relative_results, baseline,
+                          args.threshold)
+
+    if args.update_baseline:
+        baseline.update(relative_results)
+        baselines[key] = baseline
+        save_baselines(args.baseline, baselines)
+        sys.exit(0)
+    if not baseline:
+        print("No baseline for {} in {}, run with --update-baseline to "
+              "measure one.".format(key, args.baseline))
+        sys.exit(2)
+    sys.exit(1 if regressions else 0)
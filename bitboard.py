@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import binascii
+import numpy as np
+from game_map import GameMap
+from game_map_objects import GameMapObjects
+
+HEIGHT = GameMap.HEIGHT
+WIDTH = GameMap.WIDTH
+SIZE = HEIGHT * WIDTH
+
+# Masks of every cell, and of the first and last columns.
+FULL = (1 << SIZE) - 1
+FIRST_COLUMN = sum(1 << (i * WIDTH) for i in range(HEIGHT))
+LAST_COLUMN = FIRST_COLUMN << (WIDTH - 1)
+
+
+def get_bit(position):
+    """Gets the mask of a single cell.
+
+    Args:
+        position: Cell position within the map.
+
+    Returns:
+        Mask.
+    """
+    return 1 << (position[0] * WIDTH + position[1])
+
+
+def get_position(bit):
+    """Gets the cell of a single cell mask.
+
+    Args:
+        bit: Mask of a single cell.
+
+    Returns:
+        Cell position.
+    """
+    index = bit.bit_length() - 1
+    return index // WIDTH, index % WIDTH
+
+
+def shift(mask, move):
+    """Moves every cell of a mask one step.
+
+    Cells wrap around horizontally through the tunnel, and fall off the map
+    vertically.
+
+    Args:
+        mask: Mask.
+        move: (row, column) unit move.
+
+    Returns:
+        Mask.
+    """
+    rows, columns = move
+    if rows < 0:
+        mask >>= WIDTH
+    elif rows > 0:
+        mask = (mask << WIDTH) & FULL
+    if columns > 0:
+        mask = (((mask & ~LAST_COLUMN) << 1) |
+                ((mask & LAST_COLUMN) >> (WIDTH - 1)))
+    elif columns < 0:
+        mask = (((mask & ~FIRST_COLUMN) >> 1) |
+                ((mask & FIRST_COLUMN) << (WIDTH - 1)))
+    return mask
+
+
+def get_neighbors(mask):
+    """Gets the cells one step away from any cell of a mask.
+
+    Args:
+        mask: Mask.
+
+    Returns:
+        Mask.
+    """
+    return (shift(mask, (-1, 0)) | shift(mask, (1, 0)) |
+            shift(mask, (0, -1)) | shift(mask, (0, 1)))
+
+
+def popcount(mask):
+    """Counts the cells of a mask."""
+    return bin(mask).count("1")
+
+
+def iter_positions(mask):
+    """Iterates over the cells of a mask.
+
+    Args:
+        mask: Mask.
+
+    Yields:
+        Cell positions, in row-major order.
+    """
+    while mask:
+        bit = mask & -mask
+        yield get_position(bit)
+        mask ^= bit
+
+
+def from_array(cells):
+    """Packs a boolean matrix into a mask.
+
+    Args:
+        cells: HEIGHT x WIDTH boolean matrix.
+
+    Returns:
+        Mask.
+    """
+    # Most significant bit first, so that bit k is the k-th cell.
+    packed = np.packbits(np.asarray(cells, dtype=bool).ravel()[::-1])
+    return int(binascii.hexlify(packed.tobytes()), 16)
+
+
+def to_array(mask):
+    """Unpacks a mask into a boolean matrix.
+
+    Args:
+        mask: Mask.
+
+    Returns:
+        HEIGHT x WIDTH boolean matrix.
+    """
+    packed = binascii.unhexlify("{:0{}x}".format(mask, SIZE // 4))
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8))
+    return bits[::-1].reshape(HEIGHT, WIDTH).astype(bool)
+
+
+class Bitboard(object):
+
+    """Game map as one 280-bit mask per object class.
+
+    Bit i * WIDTH + j of a mask is set when cell (i, j) holds that class.
+    Masks are plain Python integers, so copying a board copies a short list
+    and set operations over the whole map are single integer operations.
+    """
+
+    # Object classes with a mask, in the order later ones overwrite earlier
+    # ones when converting back to a map.
+    CLASSES = [
+        GameMapObjects.WALL,
+        GameMapObjects.PELLET,
+        GameMapObjects.POWER_UP,
+        GameMapObjects.FRUIT,
+        GameMapObjects.GOOD_GHOST,
+        GameMapObjects.BAD_GHOST,
+        GameMapObjects.MS_PACMAN
+    ]
+
+    def __init__(self, masks=None):
+        """Constructs a Bitboard.
+
+        Args:
+            masks: List of the mask of every GameMapObjects value, empty by
+                default.
+        """
+        if masks is None:
+            masks = [0] * (max(self.CLASSES) + 1)
+        self.masks = masks
+
+    @classmethod
+    def from_map(cls, game_map):
+        """Packs a map.
+
+        Args:
+            game_map: HEIGHT x WIDTH matrix of GameMapObjects.
+
+        Returns:
+            Bitboard.
+        """
+        board = cls()
+        for classification in cls.CLASSES:
+            board.masks[classification] = from_array(
+                game_map == classification)
+        return board
+
+    def to_map(self):
+        """Unpacks the board into a map.
+
+        Returns:
+            HEIGHT x WIDTH matrix of GameMapObjects.
+        """
+        game_map = np.full((HEIGHT, WIDTH), GameMapObjects.EMPTY,
+                           dtype=np.uint8)
+        for classification in self.CLASSES:
+            if self.masks[classification]:
+                game_map[to_array(self.masks[classification])] = \
+                    classification
+        return game_map
+
+    def copy(self):
+        return Bitboard(list(self.masks))
+
+    @property
+    def occupied(self):
+        """Mask of the cells holding anything."""
+        mask = 0
+        for classification in self.CLASSES:
+            mask |= self.masks[classification]
+        return mask
+
+    def get(self, position):
+        """Gets what a cell holds.
+
+        Args:
+            position: Cell position.
+
+        Returns:
+            GameMapObjects value, the last of CLASSES if several.
+        """
+        bit = get_bit(position)
+        for classification in reversed(self.CLASSES):
+            if self.masks[classification] & bit:
+                return classification
+        return GameMapObjects.EMPTY
+
+    def set(self, position, classification):
+        """Adds an object to a cell.
+
+        Args:
+            position: Cell position.
+            classification: GameMapObjects value.
+        """
+        self.masks[classification] |= get_bit(position)
+
+    def clear(self, position, classification=None):
+        """Removes an object, or every object, from a cell.
+
+        Args:
+            position: Cell position.
+            classification: GameMapObjects value, or None for all of them.
+        """
+        bit = get_bit(position)
+        if classification is not None:
+            self.masks[classification] &= ~bit
+            return
+        for classification in self.CLASSES:
+            self.masks[classification] &= ~bit
+
+    def count(self, classification):
+        """Counts the cells holding an object class."""
+        return popcount(self.masks[classification])
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import random
+import struct
+import tempfile
+import numpy as np
+
+# File signature and format version.
+MAGIC = b"MSPACKPT"
+VERSION = 1
+
+# Fixed size header: signature, version and length of the JSON metadata.
+_HEADER = struct.Struct("<8sII")
+
+# Alignment of the weights section, so that it can be memory-mapped.
+ALIGNMENT = 64
+
+# Data type of the weights section.
+WEIGHTS_DTYPE = "<f8"
+
+
+class Checkpoint(object):
+
+    """Learner state loaded from a checkpoint file."""
+
+    def __init__(self, weights, glie, episodes, steps, rng_state):
+        """Constructs a Checkpoint.
+
+        Args:
+            weights: Array of weights, possibly memory-mapped.
+            glie: Exploration probability.
+            episodes: Number of completed episodes.
+            steps: Number of weight updates.
+            rng_state: State of the random number generators, or None.
+        """
+        self.weights = weights
+        self.glie = glie
+        self.episodes = episodes
+        self.steps = steps
+        self.rng_state = rng_state
+
+
+def get_rng_state():
+    """Captures the state of the Python and NumPy random number generators.
+
+    Returns:
+        JSON serializable state.
+    """
+    version, internal_state, gauss = random.getstate()
+    name, keys, pos, has_gauss, cached_gauss = np.random.get_state()
+    return {
+        "python": [version, list(internal_state), gauss],
+        "numpy": [name, keys.tolist(), pos, has_gauss, cached_gauss]
+    }
+
+
+def set_rng_state(rng_state):
+    """Restores the state of the Python and NumPy random number generators.
+
+    Args:
+        rng_state: State from get_rng_state().
+    """
+    version, internal_state, gauss = rng_state["python"]
+    random.setstate((version, tuple(internal_state), gauss))
+    name, keys, pos, has_gauss, cached_gauss = rng_state["numpy"]
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos,
+                         has_gauss, cached_gauss))
+
+
+def get_checkpoint_paths(prefix):
+    """Lists the checkpoint files of a prefix from the oldest to the newest.
+
+    Args:
+        prefix: Path prefix of the checkpoint files, e.g. "runs/checkpoint".
+
+    Returns:
+        List of paths.
+    """
+    directory, name = os.path.split(prefix)
+    directory = directory or "."
+    if not os.path.isdir(directory):
+        return []
+
+    pattern = re.compile(r"^{}-(\d+)\.ckpt$".format(re.escape(name)))
+    numbered_paths = []
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            numbered_paths.append((int(match.group(1)),
+                                   os.path.join(directory, filename)))
+    return [path for _, path in sorted(numbered_paths)]
+
+
+def get_latest_checkpoint(prefix):
+    """Finds the newest checkpoint file of a prefix.
+
+    Args:
+        prefix: Path prefix of the checkpoint files.
+
+    Returns:
+        Path, or None if there are none.
+    """
+    paths = get_checkpoint_paths(prefix)
+    return paths[-1] if paths else None
+
+
+def _fsync_directory(directory):
+    """Flushes the entries of a directory to disk, where supported.
+
+    Args:
+        directory: Path of the directory.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows.
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Nor flushed on some file systems.
+        pass
+    finally:
+        os.close(fd)
+
+
+def save_checkpoint(prefix, agent, retention=3):
+    """Saves the state of a learner to a new checkpoint file.
+
+    The file is written under a temporary name and then renamed, so that a
+    crash never leaves a partially written checkpoint behind. Only the
+    newest checkpoint files are kept.
+
+    The learning rate and discount factor are not saved, they are
+    hyperparameters of each run.
+
+    Args:
+        prefix: Path prefix of the checkpoint files.
+        agent: Learner to save.
+        retention: Number of checkpoint files to keep, at least 1.
+
+    Returns:
+        Path of the new checkpoint file.
+
+    Raises:
+        ValueError: If retention is less than 1.
+    """
+    if retention < 1:
+        raise ValueError("Checkpoint retention must be at least 1, got {}"
+                         .format(retention))
+
+    paths = get_checkpoint_paths(prefix)
+    number = 0
+    if paths:
+        number = int(re.search(r"-(\d+)\.ckpt$", paths[-1]).group(1)) + 1
+    path = "{}-{:06d}.ckpt".format(prefix, number)
+
+    weights = np.ascontiguousarray(agent.weights, dtype=WEIGHTS_DTYPE)
+    metadata = {
+        "glie": agent.glie,
+        "episodes": agent.episodes,
+        "steps": agent.steps,
+        "rng_state": get_rng_state(),
+        "weights_count": len(weights)
+    }
+
+    # The weights section starts at the first aligned offset after the
+    # metadata, whose length depends on that offset in turn.
+    metadata["weights_offset"] = 0
+    while True:
+        encoded = json.dumps(metadata, sort_keys=True).encode("utf-8")
+        end = _HEADER.size + len(encoded)
+        offset = -(-end // ALIGNMENT) * ALIGNMENT
+        if metadata["weights_offset"] == offset:
+            break
+        metadata["weights_offset"] = offset
+
+    directory = os.path.dirname(prefix) or "."
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-",
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(encoded)))
+            f.write(encoded)
+            f.write(b"\0" * (offset - end))
+            f.write(weights.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # The rename itself is only durable once the directory is.
+    _fsync_directory(directory)
+
+    for old_path in get_checkpoint_paths(prefix)[:-retention]:
+        os.remove(old_path)
+    return path
+
+
+def load_checkpoint(path, mmap_mode=None):
+    """Loads a checkpoint file.
+
+    Args:
+        path: Path of the checkpoint file.
+        mmap_mode: None to read the weights into memory, or a numpy.memmap
+            mode to map them instead, e.g. "r" to share them read-only
+            across processes.
+
+    Returns:
+        Checkpoint.
+
+    Raises:
+        ValueError: If the file is not a checkpoint or of an unknown version.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("Truncated checkpoint: {}".format(path))
+        magic, version, length = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a checkpoint: {}".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported checkpoint version {}: {}"
+                             .format(version, path))
+
+        metadata = json.loads(f.read(length).decode("utf-8"))
+        offset = metadata["weights_offset"]
+        count = metadata["weights_count"]
+        if mmap_mode is None:
+            f.seek(offset)
+            weights = np.frombuffer(f.read(count * 8), dtype=WEIGHTS_DTYPE)
+            if len(weights) != count:
+                raise ValueError("Truncated checkpoint: {}".format(path))
+            weights = weights.astype(np.float64)
+
+    if mmap_mode is not None:
+        weights = np.memmap(path, dtype=WEIGHTS_DTYPE, mode=mmap_mode,
+                            offset=offset, shape=(count,))
+
+    # Older checkpoints also hold the learning rate and discount factor,
+    # which are ignored.
+    return Checkpoint(weights, metadata["glie"], metadata["episodes"],
+                      metadata["steps"], metadata["rng_state"])
+
+
+class Checkpointer(object):
+
+    """Saves a learner periodically during training."""
+
+    def __init__(self, agent, step_interval=0, time_interval=0,
+                 retention=3):
+        """Constructs a Checkpointer.
+
+        Args:
+            agent: Learner to save.
+            step_interval: Number of updates in between checkpoints, 0 to
+                disable.
+            time_interval: Number of seconds in between checkpoints, 0 to
+                disable.
+            retention: Number of checkpoint files to keep, at least 1.
+
+        Raises:
+            ValueError: If retention is less than 1.
+        """
+        if retention < 1:
+            raise ValueError("Checkpoint retention must be at least 1, got "
+                             "{}".format(retention))
+
+        self.agent = agent
+        self.step_interval = step_interval
+        self.time_interval = time_interval
+        self.retention = retention
+
+        self._steps = 0
+        self._last_save = time.time()
+
+    def step(self, updates=1):
+        """Records updates, and saves a checkpoint if due.
+
+        Args:
+            updates: Number of updates, 0 to only check the time.
+        """
+        self._steps += updates
+        if self.step_interval and self._steps >= self.step_interval:
+            self.save()
+        elif (self.time_interval and
+                time.time() - self._last_save >= self.time_interval):
+            self.save()
+
+    def save(self):
+        """Saves a checkpoint now."""
+        self.agent.save(self.retention)
+        self._steps = 0
+        self._last_save = time.time()
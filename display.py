@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import sys
+import time
+import threading
+from game_map import GameMap, SlicedGameMap
+
+
+class MapDisplay(object):
+
+    """Displays the maps of a game, from a background thread if possible.
+
+    Only the latest maps submitted are kept: the decision loop never waits
+    for the screen, and frames submitted faster than the refresh rate are
+    dropped. OpenCV windows must be drawn from the main thread on macOS, so
+    there the maps are drawn synchronously by submit() instead, still
+    dropping the frames in excess of the refresh rate.
+    """
+
+    def __init__(self, max_fps=30.0, threaded=None):
+        """Constructs a MapDisplay and starts its thread, if any.
+
+        Args:
+            max_fps: Maximum number of refreshes per second.
+            threaded: Whether to draw from a background thread, everywhere
+                but on macOS by default.
+        """
+        if threaded is None:
+            threaded = sys.platform != "darwin"
+        self.max_fps = max_fps
+        self.threaded = threaded
+        self.submitted = 0
+        self.shown = 0
+
+        self._interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._last_refresh = 0.0
+
+        # Single slot holding the latest maps not shown yet, if any.
+        self._frame = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._run,
+                                            name="map-display")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __str__(self):
+        return "Map display: {} frames shown, {} dropped".format(
+            self.shown, self.dropped)
+
+    @property
+    def dropped(self):
+        """Number of frames replaced before being shown."""
+        return self.submitted - self.shown
+
+    def submit(self, game):
+        """Queues the maps of a game to be shown, replacing older ones.
+
+        Args:
+            game: MsPacManGame or GameState.
+        """
+        if not self.threaded:
+            self.submitted += 1
+            now = time.time()
+            if now - self._last_refresh >= self._interval:
+                self._last_refresh = now
+                self.shown += 1
+                self._show(game.map, game.sliced_map)
+            return
+
+        frame = (game.map.map.copy(), game.sliced_map.map.copy())
+        with self._condition:
+            self._frame = frame
+            self.submitted += 1
+            self._condition.notify()
+
+    def close(self):
+        """Stops the thread, if any, and closes the windows."""
+        if not self.threaded:
+            cv2.destroyAllWindows()
+            return
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    @staticmethod
+    def _show(game_map, sliced_map):
+        """Draws maps.
+
+        Args:
+            game_map: GameMap.
+            sliced_map: SlicedGameMap.
+        """
+        cv2.imshow("map", game_map.to_image())
+        cv2.imshow("sliced map", sliced_map.to_image())
+        cv2.waitKey(1)
+
+    def _run(self):
+        """Shows the latest frame whenever there is one, up to max_fps."""
+        while True:
+            with self._condition:
+                while self._frame is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    break
+                game_map, sliced_map = self._frame
+                self._frame = None
+                self.shown += 1
+
+            self._show(GameMap.from_map(game_map),
+                       SlicedGameMap.from_map(sliced_map))
+
+            # Let newer frames replace this one until the next refresh.
+            delay = self._last_refresh + self._interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_refresh = time.time()
+
+        cv2.destroyAllWindows()
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Size of the screen of the emulator.
+SCREEN_SHAPE = (210, 160)
+
+
+def save_fixture(path, screens, rams, rewards, lives, game_over):
+    """Saves recorded frames as a fixture.
+
+    Screens barely change from one frame to the next, so each one is stored
+    as its difference with the previous one, which compresses well.
+
+    Args:
+        path: Path of the .npz file to write.
+        screens: N x 210 x 160 array of screens.
+        rams: N x 128 array of RAM snapshots.
+        rewards: Array of the N rewards gained by reaching each frame.
+        lives: Array of the N lives remaining at each frame.
+        game_over: Array of whether the game is over at each frame.
+    """
+    screens = np.asarray(screens, dtype=np.uint8)
+    deltas = screens.copy()
+    np.bitwise_xor(screens[1:], screens[:-1], out=deltas[1:])
+    np.savez_compressed(path, screen_deltas=deltas,
+                        rams=np.asarray(rams, dtype=np.uint8),
+                        rewards=np.asarray(rewards, dtype=np.int32),
+                        lives=np.asarray(lives, dtype=np.int32),
+                        game_over=np.asarray(game_over, dtype=bool))
+
+
+def load_fixture(path):
+    """Loads a fixture saved by save_fixture().
+
+    Args:
+        path: Path of the .npz file.
+
+    Returns:
+        Dictionary of screens, rams, rewards, lives and game_over arrays.
+    """
+    with np.load(path) as fixture:
+        return {
+            "screens": np.bitwise_xor.accumulate(fixture["screen_deltas"],
+                                                 axis=0),
+            "rams": fixture["rams"],
+            "rewards": fixture["rewards"],
+            "lives": fixture["lives"],
+            "game_over": fixture["game_over"]
+        }
+
+
+class FakeALEInterface(object):
+
+    """Stand-in for ALEInterface replaying the frames of a fixture.
+
+    Every act() moves on to the next recorded frame regardless of the action,
+    so that games replay deterministically. The game is over once the frames
+    run out.
+    """
+
+    def __init__(self, fixture):
+        """Constructs a FakeALEInterface.
+
+        Args:
+            fixture: Path of a fixture, or a fixture loaded by load_fixture().
+        """
+        if not isinstance(fixture, dict):
+            fixture = load_fixture(fixture)
+        self._screens = fixture["screens"].reshape(len(fixture["screens"]),
+                                                   -1)
+        self._rams = fixture["rams"]
+        self._rewards = fixture["rewards"]
+        self._lives = fixture["lives"]
+        self._game_over = fixture["game_over"]
+        self._frame = 0
+
+    @property
+    def frame(self):
+        """Index of the current frame."""
+        return self._frame
+
+    def setInt(self, key, value):
+        pass
+
+    def setBool(self, key, value):
+        pass
+
+    def loadROM(self, path):
+        self._frame = 0
+
+    def getScreen(self, screen=None):
+        if screen is None:
+            return self._screens[self._frame].copy()
+        screen[:] = self._screens[self._frame]
+        return screen
+
+    def getRAM(self, ram=None):
+        if ram is None:
+            return self._rams[self._frame].copy()
+        ram[:] = self._rams[self._frame]
+        return ram
+
+    def lives(self):
+        return int(self._lives[self._frame])
+
+    def act(self, action):
+        if self._frame + 1 >= len(self._screens):
+            return 0
+        self._frame += 1
+        return int(self._rewards[self._frame])
+
+    def game_over(self):
+        return (bool(self._game_over[self._frame]) or
+                self._frame + 1 >= len(self._screens))
+
+    def reset_game(self):
+        self._frame = 0
+
+    def cloneState(self):
+        return self._frame
+
+    def cloneSystemState(self):
+        return self._frame
+
+    def restoreState(self, state):
+        self._frame = state
+
+    def restoreSystemState(self, state):
+        self._frame = state
+
+
+class RecordingALEInterface(object):
+
+    """Wraps an ALEInterface to record every frame it plays into a fixture.
+
+    Only linear play is recorded: restoring a state is not supported.
+    """
+
+    def __init__(self, ale):
+        """Constructs a RecordingALEInterface.
+
+        Args:
+            ale: ALEInterface to record.
+        """
+        self._ale = ale
+        self.screens = []
+        self.rams = []
+        self.rewards = []
+        self.life_counts = []
+        self.game_overs = []
+
+    def _record(self, reward):
+        """Records the current frame.
+
+        Args:
+            reward: Reward gained by reaching it.
+        """
+        self.screens.append(self._ale.getScreen().reshape(SCREEN_SHAPE))
+        self.rams.append(self._ale.getRAM())
+        self.rewards.append(reward)
+        self.life_counts.append(self._ale.lives())
+        self.game_overs.append(self._ale.game_over())
+
+    def setInt(self, key, value):
+        self._ale.setInt(key, value)
+
+    def setBool(self, key, value):
+        self._ale.setBool(key, value)
+
+    def loadROM(self, path):
+        self._ale.loadROM(path)
+        self._record(0)
+
+    def getScreen(self, screen=None):
+        if screen is None:
+            return self._ale.getScreen()
+        return self._ale.getScreen(screen)
+
+    def getRAM(self, ram=None):
+        if ram is None:
+            return self._ale.getRAM()
+        return self._ale.getRAM(ram)
+
+    def lives(self):
+        return self._ale.lives()
+
+    def act(self, action):
+        reward = self._ale.act(action)
+        self._record(reward)
+        return reward
+
+    def game_over(self):
+        return self._ale.game_over()
+
+    def cloneState(self):
+        return self._ale.cloneState()
+
+    def cloneSystemState(self):
+        return self._ale.cloneSystemState()
+
+    def restoreState(self, state):
+        raise RuntimeError("cannot record a restored state")
+
+    def restoreSystemState(self, state):
+        raise RuntimeError("cannot record a restored state")
+
+    def save(self, path):
+        """Saves the recorded frames as a fixture.
+
+        Args:
+            path: Path of the .npz file to write.
+        """
+        save_fixture(path, self.screens, self.rams, self.rewards,
+                     self.life_counts, self.game_overs)
+
+
+class SyntheticMsPacMan(object):
+
+    """Crude Ms. Pac-Man simulation to generate fixtures without a ROM.
+
+    Ms. PacMan and the ghosts wander the corridors of a made up maze, eating
+    pellets and power-ups, with the screen and RAM laid out the way
+    MsPacManGame reads them. The dynamics are nothing like the real game's,
+    but exercise the same code paths.
+    """
+
+    MAZE = [
+        "####################",
+        "#o.......##.......o#",
+        "#.##.###.##.###.##.#",
+        "#..................#",
+        "#.##.#.######.#.##.#",
+        "#....#...##...#....#",
+        "####.###.##.###.####",
+        "    ..............  ",
+        "####.#........#.####",
+        "#........##........#",
+        "#.##.###.##.###.##.#",
+        "#o.#............#.o#",
+        "#...##.######.##...#",
+        "####################"
+    ]
+
+    # Same as GameMap.PRIMARY_COLOR, and colors of the sprites and HUD.
+    PRIMARY_COLOR = 74
+    MS_PACMAN_COLOR = 210
+    GHOST_COLOR = 70
+    EDIBLE_GHOST_COLOR = 150
+    HUD_COLOR = 20
+
+    # Size of a maze cell on screen, and first screen row of the maze.
+    CELL_HEIGHT = 12
+    CELL_WIDTH = 8
+    TOP = 2
+
+    # Number of frames to move by one cell.
+    MS_PACMAN_STEP = 4
+    GHOST_STEP = 8
+
+    # Number of frames ghosts stay edible after a power-up.
+    EDIBLE_FRAMES = 150
+
+    START = (8, 10)
+    GHOST_STARTS = [(7, 8), (7, 9), (7, 10), (7, 11)]
+
+    # (row, column) moves in the order of the RAM direction bits.
+    MOVES = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+    def __init__(self, seed):
+        """Constructs a SyntheticMsPacMan.
+
+        Args:
+            seed: Random seed.
+        """
+        from ms_pacman import MsPacManGame
+        self._to_raw_position = MsPacManGame._to_raw_position
+
+        self._rng = np.random.RandomState(seed)
+        self._walls = np.array([[c == "#" for c in row] for row in self.MAZE])
+        self._items = np.array([
+            [0 if c in "# " else 50 if c == "o" else 10 for c in row]
+            for row in self.MAZE
+        ])
+        self.lives = 5
+        self.game_over = False
+        self._edible = 0
+        self._reset_positions()
+
+    def _reset_positions(self):
+        """Puts every entity back onto its starting cell."""
+        self._ms_pacman = self._Mover(self.START, 3, self.MS_PACMAN_STEP)
+        self._ghosts = [
+            self._Mover(start, 0, self.GHOST_STEP)
+            for start in self.GHOST_STARTS
+        ]
+
+    class _Mover(object):
+
+        """Entity moving from cell to cell."""
+
+        def __init__(self, cell, direction, step_frames):
+            self.cell = cell
+            self.previous = cell
+            self.direction = direction
+            self.step_frames = step_frames
+            self.frame = 0
+
+    def _neighbor(self, cell, direction):
+        """Returns the cell next to another one, through the tunnel."""
+        move = self.MOVES[direction]
+        i = cell[0] + move[0]
+        j = (cell[1] + move[1]) % len(self.MAZE[0])
+        return i, j
+
+    def _step(self, mover):
+        """Moves an entity along the corridors.
+
+        Returns:
+            Whether it reached a new cell.
+        """
+        mover.frame += 1
+        if mover.frame < mover.step_frames:
+            return False
+        mover.frame = 0
+
+        # Keep going straight most of the time, and never turn back unless
+        # stuck.
+        directions = [
+            d for d in range(4)
+            if not self._walls[self._neighbor(mover.cell, d)] and
+            d != (mover.direction + 2) % 4
+        ] or [(mover.direction + 2) % 4]
+        if mover.direction not in directions or self._rng.rand() < 0.3:
+            mover.direction = directions[self._rng.randint(len(directions))]
+
+        mover.previous = mover.cell
+        mover.cell = self._neighbor(mover.cell, mover.direction)
+        return True
+
+    def _raw_position(self, mover):
+        """Returns the RAM coordinates of an entity, in between cells."""
+        x, y = self._to_raw_position(mover.cell)
+        if abs(mover.cell[1] - mover.previous[1]) > 1:
+            # Went through the tunnel.
+            return x, y
+        previous_x, previous_y = self._to_raw_position(mover.previous)
+        t = min(1.0, (mover.frame + 1.0) / mover.step_frames)
+        return (int(round(previous_x + (x - previous_x) * t)),
+                int(round(previous_y + (y - previous_y) * t)))
+
+    def _screen_position(self, mover):
+        """Returns the top left screen pixel of an entity, in between cells."""
+        i, j = mover.cell
+        if abs(mover.cell[1] - mover.previous[1]) <= 1:
+            t = min(1.0, (mover.frame + 1.0) / mover.step_frames)
+            i = mover.previous[0] + (i - mover.previous[0]) * t
+            j = mover.previous[1] + (j - mover.previous[1]) * t
+        return (int(round(self.TOP + i * self.CELL_HEIGHT)),
+                int(round(j * self.CELL_WIDTH)))
+
+    def act(self):
+        """Plays a frame.
+
+        Returns:
+            Reward gained.
+        """
+        if self.game_over:
+            return 0
+
+        reward = 0
+        self._edible = max(0, self._edible - 1)
+        if self._step(self._ms_pacman):
+            cell = self._ms_pacman.cell
+            reward += self._items[cell]
+            if self._items[cell] == 50:
+                self._edible = self.EDIBLE_FRAMES
+            self._items[cell] = 0
+        for ghost in self._ghosts:
+            self._step(ghost)
+
+        for k, ghost in enumerate(self._ghosts):
+            if ghost.cell != self._ms_pacman.cell:
+                continue
+            if self._edible:
+                reward += 200
+                self._ghosts[k] = self._Mover(self.GHOST_STARTS[k], 0,
+                                              self.GHOST_STEP)
+            else:
+                self.lives -= 1
+                self._edible = 0
+                self._reset_positions()
+                break
+
+        if self.lives <= 0 or not self._items.any():
+            self.game_over = True
+        return reward
+
+    def screen(self):
+        """Draws the screen.
+
+        Returns:
+            210 x 160 screen array.
+        """
+        screen = np.zeros(SCREEN_SHAPE, dtype=np.uint8)
+        screen[:self.TOP] = self.HUD_COLOR
+        bottom = self.TOP + len(self.MAZE) * self.CELL_HEIGHT
+        screen[bottom:] = self.HUD_COLOR
+
+        for (i, j), wall in np.ndenumerate(self._walls):
+            top = self.TOP + i * self.CELL_HEIGHT
+            left = j * self.CELL_WIDTH
+            if wall:
+                screen[top:top + self.CELL_HEIGHT,
+                       left:left + self.CELL_WIDTH] = self.PRIMARY_COLOR
+            elif self._items[i, j] == 50:
+                screen[top + 3:top + 9, left + 1:left + 6] = \
+                    self.PRIMARY_COLOR
+            elif self._items[i, j] == 10:
+                screen[top + 5:top + 7, left + 2:left + 6] = \
+                    self.PRIMARY_COLOR
+
+        ghost_color = \
+            self.EDIBLE_GHOST_COLOR if self._edible else self.GHOST_COLOR
+        for mover, color in [(g, ghost_color) for g in self._ghosts] + \
+                [(self._ms_pacman, self.MS_PACMAN_COLOR)]:
+            top, left = self._screen_position(mover)
+            screen[top + 2:top + 10, max(0, left + 1):left + 7] = color
+        return screen
+
+    def ram(self):
+        """Lays out the entities in RAM.
+
+        Returns:
+            128 byte RAM array.
+        """
+        ram = np.zeros(128, dtype=np.uint8)
+        ram[10], ram[16] = self._raw_position(self._ms_pacman)
+        for k, ghost in enumerate(self._ghosts):
+            ram[6 + k], ram[12 + k] = self._raw_position(ghost)
+            ram[1 + k] = ghost.direction | (0x80 if self._edible else 0)
+        return ram
+
+
+def make_synthetic_fixture(path, frames=2000, seed=0):
+    """Generates a fixture from a SyntheticMsPacMan.
+
+    Args:
+        path: Path of the .npz file to write.
+        frames: Maximum number of frames.
+        seed: Random seed.
+    """
+    game = SyntheticMsPacMan(seed)
+    screens, rams, rewards, lives, game_over = [], [], [], [], []
+    reward = 0
+    for _ in range(frames):
+        screens.append(game.screen())
+        rams.append(game.ram())
+        rewards.append(reward)
+        lives.append(game.lives)
+        game_over.append(game.game_over)
+        if game.game_over:
+            break
+        reward = game.act()
+    save_fixture(path, screens, rams, rewards, lives, game_over)
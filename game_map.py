@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import cv2
+import profiler
 import numpy as np
 from map_proc import get_slice
 from game_map_objects import GameMapObjects
 
+# BGR color of every GameMapObjects value, indexed by the map to render it.
+PALETTE = np.array([
+    GameMapObjects.to_color(classification)
+    for classification in range(GameMapObjects.MS_PACMAN + 1)
+], dtype=np.uint8)
+
 
 class GameMap(object):
 
@@ -15,13 +22,21 @@ class GameMap(object):
 
     PRIMARY_COLOR = 74
 
-    def __init__(self, image, game_map=None):
+    # Minimum ratio of primary color pixels in a partition for each class.
+    WALL_RATIO = 0.40
+    POWER_UP_RATIO = 0.25
+    PELLET_RATIO = 0.05
+
+    def __init__(self, image, game_map=None, wall_cache=None):
         """Constructs a GameMap from an image.
 
         Args:
             image: OpenCV image.
+            game_map: Already classified map to wrap instead, if any.
+            wall_cache: WallLayoutCache to take static walls from, if any.
         """
         # Discard everything but map.
+        self._walls = None
         if game_map is not None:
             self._map = game_map
             return
@@ -29,10 +44,11 @@ class GameMap(object):
         self._image = image[2:170]
 
         height, width = self._image.shape
-        self._width_step = width / self.WIDTH
-        self._height_step = height / self.HEIGHT
+        self._width_step = width // self.WIDTH
+        self._height_step = height // self.HEIGHT
 
-        self._classify()
+        with profiler.timer("map.classify"):
+            self._classify(wall_cache)
 
     @classmethod
     def from_map(cls, game_map):
@@ -43,61 +59,92 @@ class GameMap(object):
         """Map of GameMapObjects."""
         return self._map
 
-    def _classify_histogram(self, histogram):
-        """Classifies an image partition based on the dominant color.
+    def _classify_counts(self, counts):
+        """Classifies image partitions based on their primary color counts.
 
         Args:
-            histogram: Color histogram.
+            counts: Array of primary color pixel counts per partition.
 
         Returns:
-            GameMapObjects enum.
+            Array of GameMapObjects enums of the same shape.
         """
-        primary_count = histogram[self.PRIMARY_COLOR]
         total_count = self._width_step * self._height_step
-        primary_ratio = primary_count / total_count
-
-        # Check if wall.
-        if primary_ratio >= 0.40:
-            return GameMapObjects.WALL
-
-        # Check if power up.
-        if primary_ratio >= 0.25:
-            return GameMapObjects.POWER_UP
-
-        # Check if pellet.
-        if primary_ratio >= 0.05:
-            return GameMapObjects.PELLET
-
-        # It's a clear path.
-        return GameMapObjects.EMPTY
-
-    def _classify_partition(self, partition):
-        """Classifies a partition.
+        primary_ratio = counts / float(total_count)
+
+        # Check from the least to the most restrictive threshold so that each
+        # partition ends up with the most restrictive classification.
+        classification = np.full(counts.shape, GameMapObjects.EMPTY,
+                                 dtype=np.uint8)
+        classification[primary_ratio >= self.PELLET_RATIO] = \
+            GameMapObjects.PELLET
+        classification[primary_ratio >= self.POWER_UP_RATIO] = \
+            GameMapObjects.POWER_UP
+        classification[primary_ratio >= self.WALL_RATIO] = \
+            GameMapObjects.WALL
+        return classification
+
+    def _count_primary(self, cells=None):
+        """Counts the primary color pixels of partitions at once.
 
         Args:
-            partition: Partition.
+            cells: (rows, columns) index arrays of the partitions to count,
+                or None for all of them.
 
         Returns:
-            GameMapObjects enum.
+            HEIGHT x WIDTH array of primary color pixel counts, or an array
+            with one count per given partition.
+        """
+        primary = (self._image == self.PRIMARY_COLOR).view(np.uint8)
+        if cells is None:
+            # Summing rows then columns of contiguous bytes is several times
+            # faster than summing both axes of the blocks at once.
+            rows = primary.reshape(self.HEIGHT, self._height_step, -1).sum(
+                axis=1, dtype=np.uint16)
+            return rows.reshape(self.HEIGHT, self.WIDTH, -1).sum(axis=2)
+
+        rows, columns = cells
+        blocks = primary.reshape(self.HEIGHT, self._height_step,
+                                 self.WIDTH, self._width_step)
+        return blocks[rows, :, columns, :].sum(axis=(1, 2),
+                                               dtype=np.uint16)
+
+    def _classify(self, wall_cache=None):
+        """Classifies the entire image.
+
+        Args:
+            wall_cache: WallLayoutCache to take static walls from, if any.
         """
-        histogram = cv2.calcHist([partition], [0], None, [256], [0, 256])
-        return self._classify_histogram(histogram)
+        counts = self._count_primary()
+        if wall_cache is None:
+            self._map = self._classify_counts(counts)
+            return
 
-    def _classify(self):
-        """Classifies the entire image."""
-        self._map = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
-        for i in range(self.WIDTH):
-            for j in range(self.HEIGHT):
-                curr_width = i * self._width_step
-                curr_height = j * self._height_step
+        # Walls are static within a maze, so the cached layout overrides
+        # walls hidden by sprites. Counting every partition at once is
+        # cheaper than gathering the others, so the observed walls come for
+        # free as the layout's fingerprint.
+        self._map = self._classify_counts(counts)
+        walls = wall_cache.lookup(self._map == GameMapObjects.WALL)
+        np.copyto(self._map, GameMapObjects.WALL, where=walls)
+        self._walls = walls
 
-                next_width = curr_width + self._width_step
-                next_height = curr_height + self._height_step
+    def reclassify(self, image, cells):
+        """Reclassifies some partitions from a new image in place.
 
-                partition = self._image[curr_height:next_height,
-                                        curr_width:next_width]
+        Args:
+            image: OpenCV image.
+            cells: (rows, columns) index arrays of the partitions to
+                reclassify.
+        """
+        self._image = image[2:170]
+        rows, columns = cells
+        if self._walls is not None:
+            paths = ~self._walls[rows, columns]
+            self._map[rows[~paths], columns[~paths]] = GameMapObjects.WALL
+            rows, columns = rows[paths], columns[paths]
 
-                self._map[j, i] = self._classify_partition(partition)
+        counts = self._count_primary((rows, columns))
+        self._map[rows, columns] = self._classify_counts(counts)
 
     def to_image(self):
         """Converts map to a viewable image.
@@ -105,50 +152,137 @@ class GameMap(object):
         Returns:
             OpenCV image.
         """
-        image = np.zeros((self.HEIGHT, self.WIDTH, 3), dtype=np.uint8)
-        for i in range(self.WIDTH):
-            for j in range(self.HEIGHT):
-                classification = self._map[j, i]
-                image[j, i] = GameMapObjects.to_color(classification)
-
+        image = PALETTE[self._map]
         upscaled_image = cv2.resize(image, (160, 168),
                                     interpolation=cv2.INTER_NEAREST)
         return upscaled_image
 
 
+class WallLayoutCache(object):
+
+    """Cache of the static wall layouts of the mazes seen so far."""
+
+    # Maximum ratio of partitions that may disagree with a cached layout for
+    # it to still be considered the current maze. Sprites only hide a few
+    # walls at a time, whereas a different maze disagrees almost everywhere.
+    MAX_MISMATCH_RATIO = 0.1
+
+    # Maximum number of layouts to remember.
+    MAX_LAYOUTS = 8
+
+    def __init__(self):
+        """Constructs an empty WallLayoutCache."""
+        # (wall mask, maximum number of mismatches) of every layout, most
+        # recently used first.
+        self._layouts = []
+
+        # Observed walls of the previous lookup, and the layout they matched.
+        self._last_walls = None
+        self._last_layout = None
+
+    @property
+    def current(self):
+        """Wall mask of the most recently matched maze, or None."""
+        return self._layouts[0][0] if self._layouts else None
+
+    def lookup(self, walls):
+        """Finds the layout of the maze the observed walls belong to.
+
+        The observed walls are fingerprinted against the cached layouts and
+        a new layout is cached when none of them match. Observed walls
+        rarely change from one screen to the next, so the previous match is
+        tried first.
+
+        Args:
+            walls: Boolean mask of partitions classified as walls on screen.
+
+        Returns:
+            Boolean wall mask of the maze.
+        """
+        key = walls.tobytes()
+        if key == self._last_walls:
+            return self._last_layout
+
+        if not walls.any():
+            # Nothing to fingerprint, e.g. in between levels.
+            layout = walls
+        else:
+            for i, (layout, max_mismatches) in enumerate(self._layouts):
+                if np.count_nonzero(layout != walls) <= max_mismatches:
+                    # Keep the most recently used layout first.
+                    if i:
+                        self._layouts.insert(0, self._layouts.pop(i))
+                    break
+            else:
+                # Layouts are never updated: walls hidden by sprites when
+                # the layout was first seen are still classified as walls
+                # from their counts, and updating them would let a layout
+                # drift over time.
+                layout = walls.copy()
+                layout.flags.writeable = False
+                max_mismatches = (self.MAX_MISMATCH_RATIO *
+                                  np.count_nonzero(layout))
+                self._layouts.insert(0, (layout, max_mismatches))
+                del self._layouts[self.MAX_LAYOUTS:]
+
+        self._last_walls = key
+        self._last_layout = layout
+        return layout
+
+    def clear(self):
+        """Forgets all cached layouts."""
+        del self._layouts[:]
+        self._last_walls = None
+        self._last_layout = None
+
+
 class SlicedGameMap(object):
 
     """Sliced game map."""
 
+    # Default radius of the slices.
     RADIUS = 2
 
-    def __init__(self, game_map, ms_pacman_position):
+    def __init__(self, game_map, ms_pacman_position, sliced_map=None,
+                 radius=RADIUS):
         """Constructs a SlicedGameMap.
 
         Args:
             game_map: Full game map.
             ms_pacman_position: Ms. PacMan's position.
+            sliced_map: Already sliced map to wrap instead, if any.
+            radius: Radius of the slice, ignored when wrapping a slice.
         """
-        self._map = get_slice(game_map, ms_pacman_position, self.RADIUS)
+        if sliced_map is not None:
+            self._map = sliced_map
+            self._radius = len(sliced_map) // 2
+            return
+
+        self._radius = radius
+        with profiler.timer("map.slice"):
+            self._map = get_slice(game_map, ms_pacman_position, radius)
+
+    @classmethod
+    def from_map(cls, sliced_map):
+        return cls(None, None, sliced_map)
 
     @property
     def map(self):
         """Map of GameMapObjects."""
         return self._map
 
+    @property
+    def radius(self):
+        """Radius of the slice."""
+        return self._radius
+
     def to_image(self):
         """Converts map to a viewable image.
 
         Returns:
             OpenCV image.
         """
-        height, width = self._map.shape
-        image = np.zeros((height, width, 3), dtype=np.uint8)
-        for i in range(width):
-            for j in range(height):
-                classification = self._map[j, i]
-                image[j, i] = GameMapObjects.to_color(classification)
-
+        image = PALETTE[self._map]
         upscaled_image = cv2.resize(image, (100, 100),
                                     interpolation=cv2.INTER_NEAREST)
         return upscaled_image
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
 
 class MovableGameMapObject(object):
 
@@ -62,6 +64,137 @@ class Fruit(MovableGameMapObject):
         return cls(position, direction, exists)
 
 
+class EntityState(object):
+
+    """State of every entity packed into a structured array.
+
+    The array holds the four ghosts, the fruit and Ms. PacMan, in that
+    order, and is filled straight from RAM.
+    """
+
+    # Indices of the entities in the array.
+    GHOST_COUNT = 4
+    GHOSTS = slice(0, GHOST_COUNT)
+    FRUIT = 4
+    MS_PACMAN = 5
+    COUNT = 6
+
+    DTYPE = np.dtype([
+        ("row", np.int16),
+        ("column", np.int16),
+        ("row_direction", np.int8),
+        ("column_direction", np.int8),
+        ("edible", np.bool_),
+        ("exists", np.bool_)
+    ])
+
+    # RAM addresses of the raw x and y coordinates of every entity, and of
+    # the direction and edibility flags of the ghosts and fruit.
+    X_ADDRESSES = [6, 7, 8, 9, 11, 10]
+    Y_ADDRESSES = [12, 13, 14, 15, 17, 16]
+    FLAG_ADDRESSES = [1, 2, 3, 4, 5]
+
+    # Moves of the two direction bits of the flags.
+    DIRECTIONS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]], dtype=np.int8)
+
+    def __init__(self, row_table, column_table):
+        """Constructs an EntityState.
+
+        Args:
+            row_table: 256 entry array of the map row of every raw y.
+            column_table: 256 entry array of the map column of every raw x.
+        """
+        self._row_table = row_table
+        self._column_table = column_table
+        self.entities = np.zeros(self.COUNT, dtype=self.DTYPE)
+        self.entities["exists"] = True
+        self._records = None
+
+    @classmethod
+    def from_entities(cls, entities):
+        """Wraps an already decoded structured array of entities.
+
+        Args:
+            entities: Structured array of DTYPE.
+
+        Returns:
+            EntityState that cannot be updated from RAM.
+        """
+        entity_state = cls(None, None)
+        entity_state.entities = entities
+        return entity_state
+
+    @property
+    def records(self):
+        """Entities as a list of tuples of Python scalars."""
+        if self._records is None:
+            self._records = self.entities.tolist()
+        return self._records
+
+    def update(self, ram):
+        """Decodes every entity from RAM.
+
+        Args:
+            ram: RAM array.
+        """
+        entities = self.entities
+        x = ram[self.X_ADDRESSES]
+        entities["row"] = self._row_table[ram[self.Y_ADDRESSES]]
+        entities["column"] = self._column_table[x]
+
+        flags = ram[self.FLAG_ADDRESSES]
+        directions = self.DIRECTIONS[flags & 3]
+        entities["row_direction"][:self.MS_PACMAN] = directions[:, 0]
+        entities["column_direction"][:self.MS_PACMAN] = directions[:, 1]
+        entities["edible"][self.GHOSTS] = (flags[self.GHOSTS] >> 7) & 1
+        entities["exists"][self.FRUIT] = x[self.FRUIT] != 0
+        self._records = None
+
+
+class MovableGameMapObjectView(object):
+
+    """Read-only view of an entity of an EntityState."""
+
+    def __init__(self, entity_state, index):
+        """Constructs a view.
+
+        Args:
+            entity_state: EntityState.
+            index: Index of the entity.
+        """
+        self._entity_state = entity_state
+        self._index = index
+
+    @property
+    def position(self):
+        record = self._entity_state.records[self._index]
+        return record[0], record[1]
+
+    @property
+    def direction(self):
+        record = self._entity_state.records[self._index]
+        return record[2], record[3]
+
+
+class GhostView(MovableGameMapObjectView, Ghost):
+
+    """Read-only view of a ghost of an EntityState."""
+
+    @property
+    def state(self):
+        edible = self._entity_state.records[self._index][4]
+        return self.GOOD if edible else self.BAD
+
+
+class FruitView(MovableGameMapObjectView, Fruit):
+
+    """Read-only view of the fruit of an EntityState."""
+
+    @property
+    def exists(self):
+        return self._entity_state.records[self._index][5]
+
+
 class GameMapObjects(object):
 
     """Game map object enumerations."""
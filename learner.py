@@ -3,41 +3,313 @@
 import os
 import pickle
 import random
-from transition_model import get_next_state
+import profiler
+import numpy as np
+from utility_cache import UtilityCache
+from checkpoint import (get_latest_checkpoint, load_checkpoint,
+                        save_checkpoint, set_rng_state)
+from transition_model import get_next_states
+from maze_distance import DISTANCE_FEATURE_COUNT, get_distance_features
+from game_map import SlicedGameMap
 from game_map_objects import GameMapObjects
 
 
+class SymmetryTable(object):
+
+    """Weight tying of the cells of slices of a radius.
+
+    Cells that map onto each other by the symmetries of the square share a
+    weight. Each orbit is identified by the distances (a, b) of its cells to
+    the center along both axes, a >= b, and orbits are numbered by
+    decreasing a and then b, so that the center comes last.
+    """
+
+    def __init__(self, radius):
+        """Constructs a SymmetryTable.
+
+        Args:
+            radius: Radius of slices.
+        """
+        self.radius = radius
+        self.size = 2 * radius + 1
+        self.cell_count = self.size ** 2
+        self.center = radius * self.size + radius
+
+        orbits = {}
+        for a in range(radius, -1, -1):
+            for b in range(a, -1, -1):
+                orbits[a, b] = len(orbits)
+        self.orbit_count = len(orbits)
+
+        # Orbit and orbit size of every cell, in row-major order.
+        self.orbits = np.empty(self.cell_count, dtype=int)
+        self.norms = np.empty(self.cell_count, dtype=np.float64)
+        for i in range(self.size):
+            for j in range(self.size):
+                a, b = sorted((abs(i - radius), abs(j - radius)),
+                              reverse=True)
+                cell = i * self.size + j
+                self.orbits[cell] = orbits[a, b]
+                self.norms[cell] = \
+                    1 if a == 0 else \
+                    4 if a == b or b == 0 else \
+                    8
+
+
+_symmetry_tables = {}
+
+
+def get_symmetry_table(radius):
+    """Gets the shared SymmetryTable of a slice radius.
+
+    Args:
+        radius: Radius of slices.
+
+    Returns:
+        SymmetryTable.
+    """
+    if radius not in _symmetry_tables:
+        _symmetry_tables[radius] = SymmetryTable(radius)
+    return _symmetry_tables[radius]
+
+
 class Learner(object):
 
+    # Path prefix of the checkpoint files.
+    CHECKPOINT_PREFIX = "checkpoint"
+
+    # Number of checkpoint files to keep.
+    CHECKPOINT_RETENTION = 3
+
+    # Legacy weights and GLIE files, only read to migrate them.
     WEIGHTS_FILE = "weights.p"
     GLIE_FILE = "glie.p"
 
-    def __init__(self, alpha=0.01, gamma=0.7):
+    # Exploration probability schedule, decayed after every update.
+    GLIE_START = 0.25
+    GLIE_MIN = 0.001
+    GLIE_DECAY = 1e-5
+
+    # Object classes with a block of features each, in feature order.
+    FEATURE_CLASSES = [
+        GameMapObjects.BAD_GHOST,
+        GameMapObjects.GOOD_GHOST,
+        GameMapObjects.PELLET,
+        GameMapObjects.POWER_UP,
+        GameMapObjects.FRUIT
+    ]
+
+    # Weights of Ms. PacMan's own cell by object class, which are not
+    # learned.
+    CENTER_WEIGHTS = {
+        GameMapObjects.BAD_GHOST: -100,
+        GameMapObjects.GOOD_GHOST: 200,
+        GameMapObjects.PELLET: 10,
+        GameMapObjects.POWER_UP: 50,
+        GameMapObjects.FRUIT: 200
+    }
+
+    def __init__(self, alpha=0.01, gamma=0.7, cache_size=0, read_only=False,
+                 distance_features=False, radius=SlicedGameMap.RADIUS):
+        """Constructs a Learner from the latest checkpoint, if any.
+
+        Args:
+            alpha: Learning rate.
+            gamma: Discount factor.
+            cache_size: Number of state utilities to cache, 0 to disable.
+            read_only: Whether the weights are never updated, in which case
+                they are memory-mapped from the checkpoint and shared with
+                other processes reading it.
+            distance_features: Whether to also weigh the maze distances from
+                Ms. PacMan to the nearest pellet, power-up and ghosts when
+                choosing and learning online. Mini-batch updates and the
+                planner only use the map slice.
+            radius: Radius of the map slices. Other radii than the default
+                one keep checkpoints of their own.
+        """
+        self.episodes = 0
+        self.steps = 0
+        self.rng_state = None
+
+        self.radius = radius
+        self._symmetry = get_symmetry_table(radius)
+        self.state_size = self._symmetry.cell_count
+        self.checkpoint_prefix = self.CHECKPOINT_PREFIX
+        if radius != SlicedGameMap.RADIUS:
+            self.checkpoint_prefix = "{}-r{}".format(self.CHECKPOINT_PREFIX,
+                                                     radius)
+        self._build_feature_tables()
+
+        path = get_latest_checkpoint(self.checkpoint_prefix)
+        if path is not None:
+            checkpoint = load_checkpoint(path, "r" if read_only else None)
+            if len(checkpoint.weights) < self._weight_count:
+                raise ValueError(
+                    "{} has {} weights but radius {} needs {}".format(
+                        path, len(checkpoint.weights), radius,
+                        self._weight_count))
+            self.weights = checkpoint.weights
+            self.glie = checkpoint.glie
+            self.episodes = checkpoint.episodes
+            self.steps = checkpoint.steps
+            self.rng_state = checkpoint.rng_state
+        elif radius == SlicedGameMap.RADIUS:
+            self._load_legacy()
+        else:
+            self.weights = np.ones(self._weight_count)
+            self.glie = self.GLIE_START
+
+        self._set_fixed_weights()
+
+        # Distance weights come after the weights of the slice features.
+        self.distance_features = distance_features
+        self._distance_offset = self._weight_count
+        distance_end = self._distance_offset + DISTANCE_FEATURE_COUNT
+        if distance_features and len(self.weights) < distance_end:
+            self.weights = np.concatenate([
+                self.weights[:self._distance_offset],
+                np.zeros(DISTANCE_FEATURE_COUNT)
+            ])
+
+        self.alpha = alpha
+        self.gamma = gamma
+
+        # Incremented whenever the weights change.
+        self.weights_version = 0
+        self.utility_cache = UtilityCache(cache_size) if cache_size else None
+
+    def _load_legacy(self):
+        """Loads the weights and GLIE from the legacy pickle files, if any."""
         if not os.path.isfile(self.WEIGHTS_FILE):
-            self.weights = [1] * 30
+            self.weights = np.ones(self._weight_count)
         else:
-            self.weights = pickle.load(open(self.WEIGHTS_FILE, "rb"))
+            with open(self.WEIGHTS_FILE, "rb") as f:
+                self.weights = np.array(pickle.load(f), dtype=np.float64)
         if not os.path.isfile(self.GLIE_FILE):
-            self.glie = 0.25
+            self.glie = self.GLIE_START
         else:
-            self.glie = pickle.load(open(self.GLIE_FILE, "rb"))
+            with open(self.GLIE_FILE, "rb") as f:
+                self.glie = pickle.load(f)
 
-        self.weights[self._to_weight_index(12)] = -100
-        self.weights[self._to_weight_index(37)] = 200
-        self.weights[self._to_weight_index(62)] = 10
-        self.weights[self._to_weight_index(87)] = 50
-        self.weights[self._to_weight_index(112)] = 200
+    def _set_fixed_weights(self):
+        """Sets the weights that are not learned."""
+        fixed_features = np.flatnonzero(self._fixed_features)
+        indices = self._weight_indices[fixed_features]
+        values = [
+            self.CENTER_WEIGHTS[self.FEATURE_CLASSES[i // self.state_size]]
+            for i in fixed_features
+        ]
+        if np.array_equal(self.weights[indices], values):
+            # Already set, e.g. in a read-only memory-mapped checkpoint.
+            return
+        if not self.weights.flags.writeable:
+            self.weights = np.array(self.weights)
+        self.weights[indices] = values
 
-        self.alpha = alpha
-        self.gamma = gamma
+    def _build_feature_tables(self):
+        """Precomputes the lookup tables used to encode and score states."""
+        symmetry = self._symmetry
+        class_count = len(self.FEATURE_CLASSES)
+        feature_count = class_count * self.state_size
+        self._weight_count = class_count * symmetry.orbit_count
+
+        # Feature index of every (object class, cell) pair, or -1 if the
+        # object class has no features, e.g. Ms. PacMan.
+        self._feature_table = np.full(
+            (GameMapObjects.MS_PACMAN + 1, self.state_size), -1, dtype=int)
+        for k, classification in enumerate(self.FEATURE_CLASSES):
+            self._feature_table[classification] = \
+                np.arange(self.state_size) + k * self.state_size
+
+        # Tied weight index and normalization factor of every feature.
+        self._weight_indices = np.array([
+            self._to_weight_index(i) for i in range(feature_count)
+        ])
+        self._weight_norms = np.tile(symmetry.norms, class_count)
+
+        # Features whose weights are fixed: Ms. PacMan's own cell.
+        self._fixed_features = np.zeros(feature_count, dtype=bool)
+        self._fixed_features[symmetry.center::self.state_size] = True
 
     def _get_utility(self, state):
-        state_rewards = self._get_state(state)
-        utility = 0
-        for i in range(len(state_rewards)):
-            w_index = self._to_weight_index(i)
-            utility += self.weights[w_index] * state_rewards[i]
-        return utility
+        features = self._get_state(state)
+        if not len(features):
+            return 0
+
+        # Accumulate in feature order so that rounding matches a sum over
+        # every feature.
+        return np.add.accumulate(
+            self.weights[self._weight_indices[features]])[-1]
+
+    def _get_utilities(self, states):
+        """Scores several states at once.
+
+        Args:
+            states: N x S x S matrix of map slices, S being the slice size.
+
+        Returns:
+            Array of N utilities.
+        """
+        if self.utility_cache is None:
+            return self._compute_utilities(states)
+
+        utilities = np.empty(len(states))
+        keys = [state.tobytes() for state in states]
+        missing = []
+        for k, key in enumerate(keys):
+            utility = self.utility_cache.get(key, self.weights_version)
+            if utility is None:
+                missing.append(k)
+            else:
+                utilities[k] = utility
+
+        if missing:
+            utilities[missing] = self._compute_utilities(states[missing])
+            for k in missing:
+                self.utility_cache.put(keys[k], self.weights_version,
+                                       utilities[k])
+        return utilities
+
+    def _compute_utilities(self, states):
+        """Scores several states at once without caching.
+
+        Args:
+            states: N x S x S matrix of map slices.
+
+        Returns:
+            Array of N utilities.
+        """
+        all_states = states.reshape(len(states), -1).astype(int)
+        features = self._feature_table[all_states,
+                                       np.arange(all_states.shape[1])]
+
+        # Weight of every feature set in any of the states, zero when not set
+        # in a state. Larger slices have many more features than are set.
+        state_indices, cells = np.nonzero(features >= 0)
+        features = features[state_indices, cells]
+        columns, feature_columns = np.unique(features, return_inverse=True)
+        if not len(columns):
+            return np.zeros(len(states))
+        weights = np.zeros((len(states), len(columns)))
+        weights[state_indices, feature_columns] = \
+            self.weights[self._weight_indices[features]]
+
+        # Accumulate in feature order so that rounding matches
+        # _get_utility().
+        return np.add.accumulate(weights, axis=1)[:, -1]
+
+    @classmethod
+    def decay_glie(cls, glie, steps=1):
+        """Decays an exploration probability.
+
+        Args:
+            glie: Exploration probability.
+            steps: Number of updates to decay it for.
+
+        Returns:
+            Decayed exploration probability.
+        """
+        return max(cls.GLIE_MIN, glie - steps * cls.GLIE_DECAY)
 
     def get_optimal_action(self, game):
         optimal_utility = float("-inf")
@@ -47,9 +319,18 @@ class Learner(object):
         if random.random() <= self.glie:
             available_actions = [random.choice(available_actions)]
 
-        for a in available_actions:
-            next_state = get_next_state(game, a)
-            utility = self._get_utility(next_state)
+        utilities = []
+        if available_actions:
+            with profiler.timer("transition"):
+                next_states = get_next_states(game, available_actions)
+            with profiler.timer("learner.utilities"):
+                utilities = self._get_utilities(next_states)
+                if self.distance_features:
+                    utilities += self._get_distance_utilities(
+                        game, available_actions)
+                utilities = utilities.tolist()
+
+        for a, utility in zip(available_actions, utilities):
             if utility > optimal_utility:
                 optimal_utility = utility
                 optimal_actions = [a]
@@ -58,82 +339,207 @@ class Learner(object):
 
         return (random.choice(optimal_actions), optimal_utility)
 
+    def get_action_utility(self, game, action):
+        """Estimates the utility of an action.
+
+        Args:
+            game: MsPacManGame or GameState to play the action in.
+            action: Action.
+
+        Returns:
+            Utility.
+        """
+        utilities = self._get_utilities(get_next_states(game, [action]))
+        if self.distance_features:
+            utilities += self._get_distance_utilities(game, [action])
+        return utilities[0]
+
+    def _get_distance_utilities(self, game, actions):
+        """Scores the maze distances after several actions.
+
+        Args:
+            game: MsPacManGame or GameState.
+            actions: Sequence of A actions.
+
+        Returns:
+            Array of A utilities.
+        """
+        positions = [
+            game.get_next_position(game.ms_pacman_position,
+                                   game.action_to_move(action))
+            for action in actions
+        ]
+        return get_distance_features(game, positions).dot(
+            self.weights[self._distance_offset:
+                         self._distance_offset + DISTANCE_FEATURE_COUNT])
+
+    def get_state_utilities(self, states):
+        """Estimates the utilities of map slices.
+
+        Args:
+            states: N x S x S matrix of map slices.
+
+        Returns:
+            Array of N utilities.
+        """
+        return self._get_utilities(states)
+
+    def get_observed_utility(self, game, reward):
+        """Computes the utility observed after an action.
+
+        Args:
+            game: MsPacManGame or GameState after the action.
+            reward: Reward gained by the action.
+
+        Returns:
+            Reward plus the discounted utility of the best next action.
+        """
+        return reward + self.gamma * self.get_optimal_action(game)[1]
+
     def update_weights(self, prev_state, action, game, guess_utility, reward):
-        self.glie = max(0.001, self.glie - 1e-5)
-        curr_state = game.sliced_map.map.copy()
-        curr_state[2, 2] = \
-            prev_state[3, 2] if action == 2 else \
-            prev_state[2, 1] if action == 3 else \
-            prev_state[2, 3] if action == 4 else \
-            prev_state[1, 2]
-
-        state_rewards = self._get_state(curr_state)
-        real_utility = reward + self.gamma * self.get_optimal_action(game)[1]
+        """Updates the weights from the outcome of an action.
+
+        Args:
+            prev_state: Map slice the action was taken from.
+            action: Action taken.
+            game: MsPacManGame after the action.
+            guess_utility: Utility the action was expected to have.
+            reward: Reward gained by the action.
+
+        Returns:
+            Tuple of (observed utility, squared error).
+        """
+        self.glie = self.decay_glie(self.glie)
+        curr_state = self.get_current_state(prev_state, action, game)
+
+        features = self._get_state(curr_state)
+        real_utility = self.get_observed_utility(game, reward)
         error = 0.5 * (real_utility - guess_utility) ** 2
 
-        print("Estimated utility: {}".format(guess_utility))
-        print("Actual utility: {}".format(real_utility))
-        print("Error: {}".format(error))
+        features = features[~self._fixed_features[features]]
+        np.add.at(self.weights, self._weight_indices[features],
+                  self.alpha * (real_utility - guess_utility) /
+                  self._weight_norms[features])
+        if self.distance_features:
+            distance_features = get_distance_features(
+                game, [game.ms_pacman_position])[0]
+            self.weights[self._distance_offset:
+                         self._distance_offset + DISTANCE_FEATURE_COUNT] += \
+                self.alpha * (real_utility - guess_utility) * distance_features
+        self.weights_version += 1
+        self.steps += 1
+        return real_utility, error
+
+    def update_weights_batch(self, chosen_states, curr_states, rewards,
+                             next_states, next_available):
+        """Updates the weights from a mini-batch of past transitions.
+
+        Unlike update_weights(), the observed utility bootstraps from the
+        best next action regardless of exploration, and from zero when there
+        is no next action. The update is the mean of the transitions'.
+
+        Args:
+            chosen_states: N x S x S predicted slices of the actions taken.
+            curr_states: N x S x S slices after the actions, see
+                get_current_state().
+            rewards: Array of N rewards.
+            next_states: N x A x S x S predicted slices of every next
+                action.
+            next_available: N x A boolean matrix of the next actions that
+                were available.
+
+        Returns:
+            Array of N squared errors.
+        """
+        count, actions = next_available.shape
+        guess_utilities = self._compute_utilities(chosen_states)
+        next_utilities = self._compute_utilities(
+            next_states.reshape((count * actions,) + next_states.shape[2:])
+        ).reshape(count, actions)
+        next_utilities[~next_available] = float("-inf")
+        best_utilities = next_utilities.max(axis=1)
+        best_utilities[~next_available.any(axis=1)] = 0
+        differences = rewards + self.gamma * best_utilities - guess_utilities
+
+        all_states = curr_states.reshape(count, -1).astype(int)
+        features = self._feature_table[all_states,
+                                       np.arange(all_states.shape[1])]
+        learned = features >= 0
+        learned[learned] = ~self._fixed_features[features[learned]]
+        state_indices, cells = np.nonzero(learned)
+        features = features[state_indices, cells]
+        np.add.at(self.weights, self._weight_indices[features],
+                  self.alpha * differences[state_indices] /
+                  self._weight_norms[features] / count)
+        self.weights_version += 1
+        return 0.5 * differences ** 2
 
-        for i in range(len(state_rewards)):
-            if i in (12, 37, 62, 87, 112):
-                continue
-            self.weights[self._to_weight_index(i)] += \
-                self.alpha * (real_utility - guess_utility) * \
-                state_rewards[i] / self._to_weight_norm(i % 25)
+    def get_current_state(self, prev_state, action, game):
+        """Gets the slice after an action, as seen by the weight updates.
+
+        Ms. PacMan's own cell holds what was there before she moved onto it.
+
+        Args:
+            prev_state: Map slice the action was taken from.
+            action: Action taken.
+            game: MsPacManGame after the action.
+
+        Returns:
+            Map slice matrix.
+        """
+        r = self.radius
+        curr_state = game.sliced_map.map.copy()
+        curr_state[r, r] = \
+            prev_state[r + 1, r] if action == 2 else \
+            prev_state[r, r - 1] if action == 3 else \
+            prev_state[r, r + 1] if action == 4 else \
+            prev_state[r - 1, r]
+        return curr_state
 
     def _get_state(self, game_map):
-        all_state = game_map.flatten()
-        size = len(all_state)
-
-        total_state = [0] * (5 * size)
-
-        for i in range(size):
-            classification = all_state[i]
-            if classification == GameMapObjects.BAD_GHOST:
-                total_state[i] = 1
-            elif classification == GameMapObjects.GOOD_GHOST:
-                total_state[i + size] = 1
-            elif classification == GameMapObjects.PELLET:
-                total_state[i + size * 2] = 1
-            elif classification == GameMapObjects.POWER_UP:
-                total_state[i + size * 3] = 1
-            elif classification == GameMapObjects.FRUIT:
-                total_state[i + size * 4] = 1
-
-        return total_state
+        """Encodes a state as its active features.
+
+        Args:
+            game_map: Map slice matrix.
+
+        Returns:
+            Sorted array of the indices of the features set in the state.
+        """
+        all_state = game_map.ravel().astype(int)
+        features = self._feature_table[all_state, np.arange(len(all_state))]
+        return np.sort(features[features >= 0])
 
     def _to_weight_index(self, i):
-        return self._to_weight_map(i % 25) + int(i / 25) * 6
-
-    def _to_weight_map(self, i):
-        return [
-            0, 1, 2, 1, 0,
-            1, 3, 4, 3, 1,
-            2, 4, 5, 4, 2,
-            1, 3, 4, 3, 1,
-            0, 1, 2, 1, 0
-        ][i]
-
-    def _to_weight_norm(self, i):
-        return [
-            4, 8, 4, 8, 4,
-            8, 4, 4, 4, 8,
-            4, 4, 1, 4, 4,
-            8, 4, 4, 4, 8,
-            4, 8, 4, 8, 4
-        ][i]
+        symmetry = self._symmetry
+        return (symmetry.orbits[i % self.state_size] +
+                i // self.state_size * symmetry.orbit_count)
 
     def human_readable_weights(self):
         s = ""
-        for i in range(5 * 25):
+        size = self._symmetry.size
+        for i in range(len(self.FEATURE_CLASSES) * self.state_size):
             s += "{:+05.2f} ".format(self.weights[self._to_weight_index(i)])
-            if i % 5 == 4:
+            if i % size == size - 1:
                 s += "\n"
-            if i % 25 == 24:
+            if i % self.state_size == self.state_size - 1:
                 s += "\n"
         return s
 
-    def save(self):
-        pickle.dump(self.weights, open(self.WEIGHTS_FILE, "wb"))
-        pickle.dump(self.glie, open(self.GLIE_FILE, "wb"))
+    def restore_rng(self):
+        """Restores the random number generators from the checkpoint, if any.
+
+        This resumes the random sequence of the run that saved it.
+        """
+        if self.rng_state is not None:
+            set_rng_state(self.rng_state)
+
+    def save(self, retention=CHECKPOINT_RETENTION):
+        """Saves a checkpoint.
+
+        Args:
+            retention: Number of checkpoint files to keep.
+
+        Returns:
+            Path of the checkpoint file.
+        """
+        return save_checkpoint(self.checkpoint_prefix, self, retention)
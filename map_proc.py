@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import threading
 import numpy as np
-from collections import deque
+from collections import deque, namedtuple
 from game_map_objects import GameMapObjects
 
 
@@ -19,65 +20,206 @@ def get_slice(game_map, pac_pos, radius):
     Deleted Parameters:
         map: Map matrix.
     """
-    min_i = pac_pos[0] - radius
-    max_i = pac_pos[0] + radius + 1
-    min_j = pac_pos[1] - radius
-    max_j = pac_pos[1] + radius + 1
-
-    vertical_slice = slice(max(min_i, 0), min(max_i, game_map.HEIGHT))
-    horizontal_slice = slice(max(min_j, 0), min(max_j, game_map.WIDTH))
-    map_slice = game_map.map[vertical_slice, horizontal_slice]
-
-    # Concatenate the opposite side of the board for a horizontal overflow.
-    if min_j < 0:
-        map_slice = np.hstack((
-            game_map.map[vertical_slice, min_j - 1:-1],
-            map_slice
-        ))
-    elif max_j >= game_map.WIDTH:
-        map_slice = np.hstack((
-            map_slice,
-            game_map.map[vertical_slice, 0:max_j - game_map.WIDTH]
-        ))
-
-    # Concatenate walls for any vertical overflow.
-    height, width = map_slice.shape
-    if min_i < 0:
-        map_slice = np.vstack((
-            np.ones((abs(min_i), width), dtype=np.uint8),
-            map_slice
-        ))
-    elif max_i >= game_map.HEIGHT:
-        map_slice = np.vstack((
-            map_slice,
-            np.ones((max_i - game_map.HEIGHT, width), dtype=np.uint8)
-        ))
+    full_map = game_map.map
+    height, width = full_map.shape
+    index = get_slice_index(full_map.shape, radius)
+    i, j = pac_pos
+    if not (0 <= i < height and 0 <= j < width):
+        # Not precomputed, but Ms. PacMan can momentarily be off the map.
+        map_slice = index.gather_outside(full_map, i, j)
+        return hide_cells_behind_wall(map_slice)
 
-    return hide_cells_behind_wall(map_slice)
+    i, j = int(i), int(j)
+    map_slice = index.take(full_map, i, j)
+    get_visibility_table(radius).hide_cells_behind_wall(full_map, i, j,
+                                                        map_slice)
+    return map_slice
 
 
-def hide_cells_behind_wall(map_slice):
-    """Hides cells which cannot be reached by Ms. PacMan.
+def get_slices(game_map, centers, radius):
+    """Extracts slices of the map centered on several positions at once.
+
+    Args:
+        game_map: Map matrix.
+        centers: Sequence of N positions in matrix.
+        radius: Radius of slices.
+
+    Returns:
+        N x (2 * radius + 1) x (2 * radius + 1) matrix of slices.
+    """
+    full_map = game_map.map
+    height, width = full_map.shape
+    if not all(0 <= i < height and 0 <= j < width for i, j in centers):
+        return np.array([
+            get_slice(game_map, center, radius) for center in centers
+        ])
+
+    rows, columns = np.array(centers, dtype=int).reshape(-1, 2).T
+    index = get_slice_index(full_map.shape, radius)
+    map_slices = index.gather(full_map, rows, columns)
+    get_visibility_table(radius).hide_cells_behind_walls(
+        full_map, rows, columns, map_slices)
+    return map_slices
+
+
+class SliceIndex(object):
+
+    """Precomputed gather indices of the slices of every map position.
+
+    Slices wrap around horizontally through the tunnel, and rows above or
+    below the map are walls.
+    """
+
+    def __init__(self, height, width, radius):
+        """Constructs a SliceIndex.
+
+        Args:
+            height: Height of the map.
+            width: Width of the map.
+            radius: Radius of slices.
+        """
+        self._height = height
+        self._width = width
+        self._offsets = np.arange(-radius, radius + 1)
+
+        rows, outside = self._rows(np.arange(height))
+        columns = self._columns(np.arange(width))
+
+        # Flat index of every cell of the slice of every position.
+        self._indices = (rows[:, np.newaxis, :, np.newaxis] * width +
+                         columns[np.newaxis, :, np.newaxis, :])
+        self._outside = np.broadcast_to(
+            outside[:, np.newaxis, :, np.newaxis], self._indices.shape)
+        self._row_outside = outside.any(axis=1)
+
+    def _rows(self, positions):
+        """Computes the slice rows of vertical positions.
+
+        Args:
+            positions: Array of vertical positions.
+
+        Returns:
+            Tuple of (clipped row indices, whether they are outside the map).
+        """
+        rows = positions[:, np.newaxis] + self._offsets
+        outside = (rows < 0) | (rows >= self._height)
+        return np.clip(rows, 0, self._height - 1), outside
+
+    def _columns(self, positions):
+        """Computes the slice columns of horizontal positions.
+
+        Args:
+            positions: Array of horizontal positions.
+
+        Returns:
+            Column indices wrapped around the map.
+        """
+        columns = positions[:, np.newaxis] + self._offsets
+        # Overflowing on the left side starts from the second to last column.
+        columns = np.where(columns < 0, columns + self._width - 1, columns)
+        return np.where(columns >= self._width, columns - self._width,
+                        columns)
+
+    def take(self, full_map, i, j):
+        """Extracts the unshadowed slice of a position within the map.
+
+        Args:
+            full_map: Map matrix.
+            i: Vertical position.
+            j: Horizontal position.
+
+        Returns:
+            (2 * radius + 1) x (2 * radius + 1) slice matrix.
+        """
+        map_slice = full_map.take(self._indices[i, j])
+        if self._row_outside[i]:
+            np.copyto(map_slice, GameMapObjects.WALL,
+                      where=self._outside[i, j])
+        return map_slice
+
+    def gather(self, full_map, rows, columns):
+        """Extracts the unshadowed slices of several positions within the map.
+
+        Args:
+            full_map: Map matrix.
+            rows: Array of N vertical positions.
+            columns: Array of N horizontal positions.
+
+        Returns:
+            N x (2 * radius + 1) x (2 * radius + 1) matrix of slices.
+        """
+        map_slices = full_map.take(self._indices[rows, columns])
+        if self._row_outside[rows].any():
+            np.copyto(map_slices, GameMapObjects.WALL,
+                      where=self._outside[rows, columns])
+        return map_slices
+
+    def gather_outside(self, full_map, i, j):
+        """Extracts the unshadowed slice of any position, even off the map.
+
+        Args:
+            full_map: Map matrix.
+            i: Vertical position.
+            j: Horizontal position.
+
+        Returns:
+            (2 * radius + 1) x (2 * radius + 1) slice matrix.
+        """
+        rows, outside = self._rows(np.array([i], dtype=int))
+        columns = self._columns(np.array([j], dtype=int))
+        map_slice = full_map.take(rows[0, :, np.newaxis] * self._width +
+                                  columns[0, np.newaxis, :])
+        np.copyto(map_slice, GameMapObjects.WALL,
+                  where=outside[0, :, np.newaxis])
+        return map_slice
+
+
+# Shared tables, which pipelined games build from several threads.
+_tables_lock = threading.Lock()
+_slice_indices = {}
+
+
+def get_slice_index(shape, radius):
+    """Gets the shared SliceIndex of a map shape and slice radius.
+
+    Args:
+        shape: (height, width) of the map.
+        radius: Radius of slices.
+
+    Returns:
+        SliceIndex.
+    """
+    key = (shape, radius)
+    index = _slice_indices.get(key)
+    if index is None:
+        with _tables_lock:
+            index = _slice_indices.get(key)
+            if index is None:
+                index = _slice_indices[key] = SliceIndex(shape[0], shape[1],
+                                                         radius)
+    return index
+
+
+def _get_reachable_cells(map_slice):
+    """Finds the cells of a slice which can be seen by Ms. PacMan.
 
     Args:
         map_slice: Map slice matrix.
 
     Returns:
-        Map slice with cells that cannot be reached emptied.
+        Boolean matrix of the cells reachable from the center, including the
+        walls bordering them.
     """
     height, width = map_slice.shape
-    center = (height - 1) / 2
+    center = (height - 1) // 2
 
-    # One is the same as GameMapObjects.WALL.
-    shadowed_map = np.ones((height, width))
-    visited = np.zeros((height, width))
+    visited = np.zeros((height, width), dtype=bool)
     neighbor_queue = deque()
     neighbor_queue.append((center, center))
 
     while neighbor_queue:
         cell = neighbor_queue.popleft()
-        visited[cell] = 1
-        shadowed_map[cell] = map_slice[cell]
+        visited[cell] = True
         if map_slice[cell] == GameMapObjects.WALL:
             continue
         for neighbor in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
@@ -86,4 +228,215 @@ def hide_cells_behind_wall(map_slice):
             if 0 <= i < height and 0 <= j < width and not visited[(i, j)]:
                 neighbor_queue.append((i, j))
 
-    return shadowed_map
+    return visited
+
+
+def hide_cells_behind_wall(map_slice):
+    """Hides cells which cannot be reached by Ms. PacMan.
+
+    Args:
+        map_slice: Map slice matrix.
+
+    Returns:
+        Map slice with cells that cannot be reached emptied.
+    """
+    # One is the same as GameMapObjects.WALL.
+    return np.where(_get_reachable_cells(map_slice), map_slice,
+                    GameMapObjects.WALL).astype(map_slice.dtype)
+
+
+# Reachable cells of the slices of every position of a wall layout, see
+# VisibilityTable. Never modified once built, so that threads can share it.
+_VisibilityLayout = namedtuple("_VisibilityLayout",
+                               ["walls", "slice_wall_keys", "hidden"])
+
+
+class VisibilityTable(object):
+
+    """Precomputed reachable cells of the slices of every map position.
+
+    Which cells of a slice can be reached only depends on its walls, and
+    walls are static within a maze, so the reachable cells of every slice
+    position are computed once per wall layout.
+
+    The table can be shared by several threads: each lookup reads the
+    current layout once, and layouts are only ever replaced as a whole. The
+    last few layouts are kept, so that states of the previous maze still
+    being trained on do not rebuild the table back and forth at level
+    changes.
+    """
+
+    # Maximum number of cells whose walls may differ from the wall layout the
+    # table was built for before it is rebuilt. Entities drawn over walls
+    # only change a few cells, whereas a different maze changes many.
+    MAX_WALL_CHANGES = 8
+
+    # Maximum number of wall layouts to keep.
+    MAX_LAYOUTS = 2
+
+    def __init__(self, radius):
+        """Constructs an empty VisibilityTable.
+
+        Args:
+            radius: Radius of slices.
+        """
+        self._radius = radius
+        self._layout = None
+        self._layouts = []
+        self._lock = threading.Lock()
+
+    def _build(self, walls):
+        """Builds the layout of a wall mask.
+
+        Args:
+            walls: Boolean wall mask of the full map.
+
+        Returns:
+            _VisibilityLayout.
+        """
+        height, width = walls.shape
+        index = get_slice_index(walls.shape, self._radius)
+        rows, columns = np.indices(walls.shape).reshape(2, -1)
+        wall_map = walls.astype(np.uint8) * GameMapObjects.WALL
+        wall_slices = index.gather(wall_map, rows, columns)
+
+        slice_walls = (wall_slices == GameMapObjects.WALL).reshape(
+            (height, width) + wall_slices.shape[1:])
+        slice_wall_keys = [
+            [slice_walls[i, j].tobytes() for j in range(width)]
+            for i in range(height)
+        ]
+        hidden = ~np.array([
+            _get_reachable_cells(wall_slice) for wall_slice in wall_slices
+        ]).reshape(slice_walls.shape)
+        return _VisibilityLayout(walls.copy(), slice_wall_keys, hidden)
+
+    def _matches(self, layout, walls):
+        """Returns whether a layout was built for about the same walls.
+
+        Args:
+            layout: _VisibilityLayout.
+            walls: Boolean wall mask of the full map.
+
+        Returns:
+            Whether the layout can be used.
+        """
+        return (np.count_nonzero(walls != layout.walls) <=
+                self.MAX_WALL_CHANGES)
+
+    def _get_layout(self, full_map, layout):
+        """Gets the layout of the walls of a map.
+
+        Args:
+            full_map: Map matrix.
+            layout: Layout the caller already has, if any.
+
+        Returns:
+            _VisibilityLayout, the caller's own one if it still matches.
+        """
+        walls = full_map == GameMapObjects.WALL
+        if layout is not None and self._matches(layout, walls):
+            return layout
+
+        with self._lock:
+            for layout in self._layouts:
+                if self._matches(layout, walls):
+                    break
+            else:
+                layout = self._build(walls)
+                self._layouts = ([layout] +
+                                 self._layouts)[:self.MAX_LAYOUTS]
+            self._layout = layout
+        return layout
+
+    def hide_cells_behind_wall(self, full_map, i, j, map_slice):
+        """Hides cells of a slice which cannot be reached by Ms. PacMan.
+
+        Args:
+            full_map: Map matrix the slice was taken from.
+            i: Vertical position within the map the slice is centered on.
+            j: Horizontal position within the map the slice is centered on.
+            map_slice: Map slice matrix, shadowed in place.
+        """
+        layout = self._layout
+        key = (map_slice == GameMapObjects.WALL).tobytes()
+        if layout is None or key != layout.slice_wall_keys[i][j]:
+            layout = self._get_layout(full_map, layout)
+            if key != layout.slice_wall_keys[i][j]:
+                # Only a few cells differ, e.g. an entity drawn over a wall.
+                np.copyto(map_slice, GameMapObjects.WALL,
+                          where=~_get_reachable_cells(map_slice))
+                return
+
+        np.copyto(map_slice, GameMapObjects.WALL, where=layout.hidden[i, j])
+
+    def hide_cells_behind_walls(self, full_map, rows, columns, map_slices):
+        """Hides cells of slices which cannot be reached by Ms. PacMan.
+
+        Args:
+            full_map: Map matrix the slices were taken from.
+            rows: Array of N vertical positions within the map the slices
+                are centered on.
+            columns: Array of N horizontal positions the slices are
+                centered on.
+            map_slices: N x (2 * radius + 1) x (2 * radius + 1) matrix of
+                slices, shadowed in place.
+        """
+        layout = self._layout
+        slice_walls = map_slices == GameMapObjects.WALL
+        mismatches = self._find_mismatches(layout, rows, columns, slice_walls)
+        if mismatches:
+            new_layout = self._get_layout(full_map, layout)
+            if new_layout is not layout:
+                layout = new_layout
+                mismatches = self._find_mismatches(layout, rows, columns,
+                                                   slice_walls)
+
+        hidden = layout.hidden[rows, columns]
+        for k in mismatches:
+            # Only a few cells differ, e.g. an entity drawn over a wall.
+            hidden[k] = ~_get_reachable_cells(map_slices[k])
+        np.copyto(map_slices, GameMapObjects.WALL, where=hidden)
+
+    @staticmethod
+    def _find_mismatches(layout, rows, columns, slice_walls):
+        """Finds the slices whose walls differ from a layout's.
+
+        Args:
+            layout: _VisibilityLayout, or None.
+            rows: Array of N vertical positions the slices are centered on.
+            columns: Array of N horizontal positions the slices are
+                centered on.
+            slice_walls: N x (2 * radius + 1) x (2 * radius + 1) boolean
+                wall masks of the slices.
+
+        Returns:
+            List of indices of the slices that differ.
+        """
+        if layout is None:
+            return list(range(len(slice_walls)))
+        return [
+            k for k, (i, j) in enumerate(zip(rows.tolist(), columns.tolist()))
+            if slice_walls[k].tobytes() != layout.slice_wall_keys[i][j]
+        ]
+
+
+_visibility_tables = {}
+
+
+def get_visibility_table(radius):
+    """Gets the shared VisibilityTable of a slice radius.
+
+    Args:
+        radius: Radius of slices.
+
+    Returns:
+        VisibilityTable.
+    """
+    table = _visibility_tables.get(radius)
+    if table is None:
+        with _tables_lock:
+            table = _visibility_tables.get(radius)
+            if table is None:
+                table = _visibility_tables[radius] = VisibilityTable(radius)
+    return table
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from collections import OrderedDict
+from game_map_objects import GameMapObjects, Ghost
+
+
+class MazeDistances(object):
+
+    """Shortest path lengths in between every pair of cells of a maze.
+
+    Paths go through every cell but walls, wrapping around horizontally
+    through the tunnel. They may start from a wall, since sprites are
+    sometimes located on one, but never go through one.
+    """
+
+    # Distance of the cells that cannot be reached, also the cap of the
+    # distances of those that can.
+    UNREACHABLE = 255
+
+    def __init__(self, walls):
+        """Computes the distances of a maze by breadth-first search.
+
+        Args:
+            walls: Boolean matrix of the walls.
+        """
+        height, width = walls.shape
+        self._width = width
+        size = height * width
+
+        # Adjacency matrix of every cell to its neighboring paths.
+        adjacency = np.zeros((size, size), dtype=np.float32)
+        rows, columns = np.divmod(np.arange(size), width)
+        for move_rows, move_columns in [(-1, 0), (0, 1), (0, -1), (1, 0)]:
+            neighbor_rows = rows + move_rows
+            neighbor_columns = (columns + move_columns) % width
+            valid = (0 <= neighbor_rows) & (neighbor_rows < height)
+            sources = np.flatnonzero(valid)
+            neighbors = neighbor_rows[valid] * width + neighbor_columns[valid]
+            paths = ~walls.ravel()[neighbors]
+            adjacency[sources[paths], neighbors[paths]] = 1
+
+        # Expand the frontiers from every cell at once.
+        self.distances = np.full((size, size), self.UNREACHABLE,
+                                 dtype=np.uint8)
+        np.fill_diagonal(self.distances, 0)
+        seen = np.eye(size, dtype=bool)
+        frontier = np.eye(size, dtype=np.float32)
+        distance = 0
+        while distance < self.UNREACHABLE - 1:
+            distance += 1
+            reached = (frontier.dot(adjacency) > 0) & ~seen
+            if not reached.any():
+                break
+            self.distances[reached] = distance
+            seen |= reached
+            frontier = reached.astype(np.float32)
+
+    def index(self, position):
+        """Gets the row of a cell within the distance matrix."""
+        return position[0] * self._width + position[1]
+
+    def distance(self, source, target):
+        """Gets the length of the shortest path in between two cells.
+
+        Args:
+            source: Cell position.
+            target: Cell position.
+
+        Returns:
+            Number of moves, UNREACHABLE if there is no path.
+        """
+        return int(self.distances[self.index(source), self.index(target)])
+
+    def nearest(self, source, targets):
+        """Gets the length of the shortest path to the nearest of some cells.
+
+        Args:
+            source: Cell position.
+            targets: Array of the indices of the target cells, see index().
+
+        Returns:
+            Number of moves, UNREACHABLE if there is no path.
+        """
+        if not len(targets):
+            return self.UNREACHABLE
+        return int(self.distances[self.index(source), targets].min())
+
+    def nearest_object(self, source, game_map, classification):
+        """Gets the length of the shortest path to an object class.
+
+        Args:
+            source: Cell position.
+            game_map: Map matrix.
+            classification: GameMapObjects value.
+
+        Returns:
+            Number of moves, UNREACHABLE if there is no path.
+        """
+        return self.nearest(source,
+                            np.flatnonzero(game_map.ravel() == classification))
+
+    def ghost_distances(self, source, ghosts):
+        """Gets the length of the shortest path to every ghost.
+
+        Args:
+            source: Cell position.
+            ghosts: Ghosts.
+
+        Returns:
+            List of numbers of moves, UNREACHABLE if there is no path, e.g.
+            when the ghost is off the map.
+        """
+        height = len(self.distances) // self._width
+        return [
+            self.distance(source, ghost.position)
+            if 0 <= ghost.position[0] < height and
+            0 <= ghost.position[1] < self._width
+            else self.UNREACHABLE
+            for ghost in ghosts
+        ]
+
+
+# Maximum number of wall layouts to remember the distances of.
+MAX_LAYOUTS = 8
+
+_maze_distances = OrderedDict()
+
+
+def get_maze_distances(walls):
+    """Gets the shared MazeDistances of a wall layout.
+
+    Args:
+        walls: Boolean matrix of the walls.
+
+    Returns:
+        MazeDistances.
+    """
+    key = walls.tobytes()
+    maze_distances = _maze_distances.pop(key, None)
+    if maze_distances is None:
+        maze_distances = MazeDistances(walls)
+    _maze_distances[key] = maze_distances
+    while len(_maze_distances) > MAX_LAYOUTS:
+        _maze_distances.popitem(last=False)
+    return maze_distances
+
+
+# Number of features of get_distance_features().
+DISTANCE_FEATURE_COUNT = 4
+
+
+def get_distance_features(game, positions):
+    """Encodes the maze distances from positions to what matters.
+
+    The features are the inverse distances to the nearest pellet, power-up,
+    dangerous ghost and edible ghost, or zero when there is none.
+
+    Args:
+        game: MsPacManGame or GameState.
+        positions: Sequence of N positions of Ms. PacMan.
+
+    Returns:
+        N x DISTANCE_FEATURE_COUNT matrix of features.
+    """
+    blank_map = game.blank_map.map
+    height, width = blank_map.shape
+    maze_distances = get_maze_distances(blank_map == GameMapObjects.WALL)
+    cells = blank_map.ravel()
+
+    bad_ghosts = []
+    good_ghosts = []
+    for ghost in game.ghosts:
+        i, j = ghost.position
+        if 0 <= i < height and 0 <= j < width:
+            ghosts = good_ghosts if ghost.state == Ghost.GOOD else bad_ghosts
+            ghosts.append(i * width + j)
+
+    targets = [
+        np.flatnonzero(cells == GameMapObjects.PELLET),
+        np.flatnonzero(cells == GameMapObjects.POWER_UP),
+        bad_ghosts,
+        good_ghosts
+    ]
+
+    features = np.zeros((len(positions), DISTANCE_FEATURE_COUNT))
+    for k, (i, j) in enumerate(positions):
+        if not (0 <= i < height and 0 <= j < width):
+            continue
+        for f, target_cells in enumerate(targets):
+            distance = maze_distances.nearest((i, j), target_cells)
+            if distance < MazeDistances.UNREACHABLE:
+                features[k, f] = 1.0 / (1 + distance)
+    return features
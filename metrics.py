@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import sys
+import json
+import time
+
+
+class Aggregator(object):
+
+    """Running count, mean, minimum and maximum of a value."""
+
+    def __init__(self):
+        """Constructs an empty Aggregator."""
+        self.reset()
+
+    def reset(self):
+        """Forgets every value added so far."""
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+
+    def add(self, value):
+        """Adds a value.
+
+        Args:
+            value: Number.
+        """
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    @property
+    def mean(self):
+        """Mean of the values added, or None if there are none."""
+        return self.total / self.count if self.count else None
+
+
+class Metrics(object):
+
+    """Training metrics sink.
+
+    Per-step values are aggregated in memory and written out as one row per
+    flush interval, along with a row per completed episode, either as JSON
+    lines or as CSV depending on the extension of the file. A short summary
+    is printed to the console at most once per console interval.
+    """
+
+    # Values recorded at every step, aggregated in between flushes.
+    STEP_METRICS = ("reward", "expected_utility", "actual_utility", "error",
+                    "glie")
+
+    # Columns of the rows written out.
+    FIELDS = ["kind", "time", "episode", "steps", "score"] + [
+        "{}_{}".format(name, statistic)
+        for name in STEP_METRICS
+        for statistic in ("mean", "min", "max")
+    ]
+
+    def __init__(self, path=None, flush_interval=10.0, console_interval=5.0):
+        """Constructs a Metrics sink.
+
+        Args:
+            path: File to write to, CSV if it ends with .csv and JSON lines
+                otherwise, or None not to write any.
+            flush_interval: Number of seconds in between writes.
+            console_interval: Minimum number of seconds in between console
+                summaries, or None to print nothing.
+        """
+        self.flush_interval = flush_interval
+        self.console_interval = console_interval
+
+        self.episodes = 0
+        self.steps = 0
+        self.scores = Aggregator()
+        self._window = dict((name, Aggregator()) for name in self.STEP_METRICS)
+        self._rows = []
+
+        self._file = None
+        self._writer = None
+        if path is not None:
+            if path.endswith(".csv"):
+                if sys.version_info[0] < 3:
+                    self._file = open(path, "wb")
+                else:
+                    self._file = io.open(path, "w", newline="")
+                self._writer = csv.DictWriter(self._file, self.FIELDS)
+                self._writer.writeheader()
+            else:
+                self._file = io.open(path, "w", encoding="utf-8")
+
+        now = time.time()
+        self._last_flush = now
+        self._last_console = now
+        self._console_steps = 0
+
+    def step(self, reward, expected_utility, actual_utility=None, error=None,
+             glie=None):
+        """Records a step.
+
+        Args:
+            reward: Reward gained by the step's action.
+            expected_utility: Utility the action was chosen with.
+            actual_utility: Utility observed after the action, if learning.
+            error: Squared temporal difference error, if learning.
+            glie: Exploration probability, if learning.
+        """
+        self.steps += 1
+        window = self._window
+        window["reward"].add(reward)
+        window["expected_utility"].add(expected_utility)
+        if actual_utility is not None:
+            window["actual_utility"].add(actual_utility)
+            window["error"].add(error)
+            window["glie"].add(glie)
+
+        now = time.time()
+        if (self.console_interval is not None and
+                now - self._last_console >= self.console_interval):
+            self._print_summary(now)
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def episode(self, score, steps=0):
+        """Records a completed episode.
+
+        Args:
+            score: Total reward of the episode.
+            steps: Number of steps of the episode not recorded by step(),
+                e.g. played in another process.
+        """
+        self.episodes += 1
+        self.steps += steps
+        self.scores.add(score)
+        if self._file is not None:
+            self._rows.append({
+                "kind": "episode",
+                "time": time.time(),
+                "episode": self.episodes,
+                "steps": self.steps,
+                "score": score
+            })
+
+        if self.console_interval is not None:
+            print("Episode Complete {}: {}".format(self.episodes, score))
+            print("Average: {}".format(self.scores.mean))
+            print("Max: {}".format(self.scores.maximum))
+            print("Min: {}".format(self.scores.minimum))
+
+    def _print_summary(self, now):
+        """Prints a summary of the current window.
+
+        Args:
+            now: Current time.
+        """
+        window = self._window
+        rate = (self.steps - self._console_steps) / (now - self._last_console)
+        summary = "Episode {} step {}: {:.1f} steps/s, mean reward {:.2f}" \
+            .format(self.episodes + 1, self.steps, rate,
+                    window["reward"].mean or 0.0)
+        if window["error"].count:
+            summary += ", mean error {:.2f}, GLIE {:.5f}".format(
+                window["error"].mean, window["glie"].maximum)
+        print(summary)
+        self._last_console = now
+        self._console_steps = self.steps
+
+    def flush(self):
+        """Writes out the current window and the completed episodes."""
+        self._last_flush = time.time()
+        if self._file is None:
+            for aggregator in self._window.values():
+                aggregator.reset()
+            return
+
+        if self._window["reward"].count:
+            row = {
+                "kind": "steps",
+                "time": self._last_flush,
+                "episode": self.episodes + 1,
+                "steps": self.steps
+            }
+            for name, aggregator in self._window.items():
+                if aggregator.count:
+                    row[name + "_mean"] = aggregator.mean
+                    row[name + "_min"] = aggregator.minimum
+                    row[name + "_max"] = aggregator.maximum
+                aggregator.reset()
+            self._rows.append(row)
+
+        for row in self._rows:
+            if self._writer is not None:
+                self._writer.writerow(row)
+            else:
+                self._file.write(u"{}\n".format(json.dumps(row,
+                                                          sort_keys=True)))
+        del self._rows[:]
+        self._file.flush()
+
+    def close(self):
+        """Flushes and closes the file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class NullMetrics(object):
+
+    """Metrics sink that discards everything."""
+
+    def step(self, reward, expected_utility, actual_utility=None, error=None,
+             glie=None):
+        pass
+
+    def episode(self, score, steps=0):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
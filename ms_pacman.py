@@ -2,54 +2,84 @@
 
 import sys
 import random
-from game_map import GameMap, SlicedGameMap
-from ale_python_interface import ALEInterface
-from game_map_objects import GameMapObjects, Fruit, Ghost
+import profiler
+import numpy as np
+from game_map import GameMap, SlicedGameMap, WallLayoutCache
+from game_map_objects import (GameMapObjects, EntityState, FruitView,
+                              Ghost, GhostView)
 
 
-class MsPacManGame(object):
+class GameSnapshot(object):
 
-    """Ms. Pac-Man Arcade Learning Environment wrapper class."""
+    """Snapshot of a MsPacManGame to restore later on."""
 
-    def __init__(self, seed, display):
-        """Constructs a MsPacManGame.
+    def __init__(self, state, system_state, reward, blank_map):
+        """Constructs a GameSnapshot.
 
         Args:
-            seed: Initial random seed, randomized when None.
-            display: Whether to display onto the screen or not.
+            state: Emulator state, without the random number generator.
+            system_state: Emulator system state, with the random number
+                generator.
+            reward: Total reward.
+            blank_map: Map matrix without any entity.
         """
-        self._ale = ALEInterface()
+        self.state = state
+        self.system_state = system_state
+        self.reward = reward
+        self.blank_map = blank_map
 
-        if seed is None:
-            seed = random.randint(0, 255)
-        self._ale.setInt("random_seed", seed)
 
-        if display:
-            if sys.platform == "darwin":
-                # Use PyGame in macOS.
-                import pygame
-                pygame.init()
+class GameState(object):
 
-                # Sound doesn't work on macOS.
-                self._ale.setBool("sound", False)
-            elif sys.platform.startswith("linux"):
-                self._ale.setBool("sound", True)
+    """State of a game at a decision point, without an emulator.
 
-            self._ale.setBool("display_screen", True)
-
-        self._ale.loadROM("MS_PACMAN.BIN")
+    This is all the learner needs to pick and evaluate actions, e.g. to
+    train on a recorded trace or while the emulator plays on.
+    """
 
-        self._reward = 0
-        self._raw_ms_pacman_position = (0, 0)
+    def __init__(self, blank_map, game_map, sliced_map, entities, reward=0,
+                 lives=0):
+        """Constructs a GameState.
 
-        self.__screen = self._ale.getScreen()
-        self.__ram = self._ale.getRAM()
+        Args:
+            blank_map: Map matrix without any entity.
+            game_map: Map matrix with the entities.
+            sliced_map: Slice matrix around Ms. PacMan.
+            entities: Structured array of the entities, see EntityState.
+            reward: Total reward.
+            lives: Lives remaining.
+        """
+        self._blank_map = GameMap.from_map(blank_map)
+        self._map = GameMap.from_map(game_map)
+        self._sliced_map = SlicedGameMap.from_map(sliced_map)
+        self._set_entity_state(EntityState.from_entities(entities))
+        ms_pacman = self._entity_state.records[EntityState.MS_PACMAN]
+        self._ms_pacman_position = (ms_pacman[0], ms_pacman[1])
+        self._reward = reward
+        self._lives = lives
+
+    def _set_entity_state(self, entity_state):
+        """Sets the entities and their views.
 
-        self._lives = self._ale.lives()
+        Args:
+            entity_state: EntityState.
+        """
+        self._entity_state = entity_state
+        self._ghosts = [
+            GhostView(entity_state, i)
+            for i in range(EntityState.GHOST_COUNT)
+        ]
+        self._fruit = FruitView(entity_state, EntityState.FRUIT)
 
-        self._update_state()
+    def freeze(self):
+        """Copies the current state.
 
-        self._go_to((94, 98), 3)
+        Returns:
+            GameState.
+        """
+        return GameState(self._blank_map.map.copy(), self._map.map.copy(),
+                         self._sliced_map.map.copy(), self.entities.copy(),
+                         self._reward, self._lives)
 
     @property
     def lives(self):
@@ -61,6 +91,11 @@ class MsPacManGame(object):
         """Current total reward."""
         return self._reward
 
+    @property
+    def blank_map(self):
+        """Current game map without any entity."""
+        return self._blank_map
+
     @property
     def map(self):
         """Current game map."""
@@ -86,6 +121,11 @@ class MsPacManGame(object):
         """List of ghosts."""
         return self._ghosts
 
+    @property
+    def entities(self):
+        """Structured array of the state of every entity, see EntityState."""
+        return self._entity_state.entities
+
     def available_actions(self):
         """Returns a list of available actions to consider."""
         actions = []
@@ -116,6 +156,94 @@ class MsPacManGame(object):
             new_pos = (new_pos[0], new_pos[1] - GameMap.WIDTH)
         return new_pos
 
+
+class MsPacManGame(GameState):
+
+    """Ms. Pac-Man Arcade Learning Environment wrapper class."""
+
+    # Number of incremental map updates in between full map updates.
+    MAP_SYNC_INTERVAL = 10
+
+    # Snapshots of the first decision point of an episode by seed, shared by
+    # the games using the Arcade Learning Environment.
+    _start_snapshots = {}
+
+    # Map row of every raw y coordinate and map column of every raw x
+    # coordinate, built from _to_map_position().
+    _row_table = None
+    _column_table = None
+
+    def __init__(self, seed, display, incremental_map=False, ale=None,
+                 radius=SlicedGameMap.RADIUS):
+        """Constructs a MsPacManGame.
+
+        Args:
+            seed: Initial random seed, randomized when None.
+            display: Whether to display onto the screen or not.
+            incremental_map: Whether to only reclassify the cells that might
+                have changed in between full map updates.
+            ale: Emulator with the ALEInterface API to use instead of the
+                Arcade Learning Environment, e.g. a FakeALEInterface.
+            radius: Radius of the slices around Ms. PacMan.
+        """
+        if ale is None:
+            from ale_python_interface import ALEInterface
+            self._ale = ALEInterface()
+            start_snapshots = self._start_snapshots
+        else:
+            self._ale = ale
+            start_snapshots = {}
+
+        if seed is None:
+            seed = random.randint(0, 255)
+        self._ale.setInt("random_seed", seed)
+
+        if display:
+            if sys.platform == "darwin":
+                # Use PyGame in macOS.
+                import pygame
+                pygame.init()
+
+                # Sound doesn't work on macOS.
+                self._ale.setBool("sound", False)
+            elif sys.platform.startswith("linux"):
+                self._ale.setBool("sound", True)
+
+            self._ale.setBool("display_screen", True)
+
+        self._ale.loadROM("MS_PACMAN.BIN")
+
+        self._reward = 0
+        self._raw_ms_pacman_position = (0, 0)
+        self._wall_cache = WallLayoutCache()
+
+        self._radius = radius
+        self._incremental_map = incremental_map
+        self._map_updates = 0
+        self._dirty_cells = set()
+        self._stamped_cells = []
+
+        self.__screen = self._ale.getScreen()
+        self.__ram = self._ale.getRAM()
+
+        self._build_position_tables()
+        self._set_entity_state(EntityState(self._row_table,
+                                           self._column_table))
+
+        self._lives = self._ale.lives()
+
+        self._update_state()
+
+        # Only play through the intro once per seed, every other episode
+        # starts from a snapshot of the first decision point.
+        if seed in start_snapshots:
+            self._start_snapshot = start_snapshots[seed]
+            self.restore_snapshot(self._start_snapshot)
+        else:
+            self._go_to((94, 98), 3)
+            self._start_snapshot = self.save_snapshot()
+            start_snapshots[seed] = self._start_snapshot
+
     def act(self, action):
         """Plays a given action in the game.
 
@@ -141,11 +269,17 @@ class MsPacManGame(object):
                 break
 
             if self.game_over() or self._lives < old_lives:
+                # Everything moves back into place, so resync the whole map.
+                self._map_updates = 0
+                self._update_state()
                 return GameMapObjects.to_reward(GameMapObjects.BAD_GHOST)
 
-            self._reward += self._ale.act(action)
-            self._update_state()
+            with profiler.timer("ale.act"):
+                self._reward += self._ale.act(action)
+            self._probe_state()
+            self._dirty_cells.add(self._ms_pacman_position)
 
+        self._update_state()
         self._update_map()
         return self._reward - old_reward
 
@@ -153,20 +287,66 @@ class MsPacManGame(object):
         """Goes to a given position."""
         while (abs(self._raw_ms_pacman_position[0] - raw_pos[0]) > 1 or
                 abs(self._raw_ms_pacman_position[1] - raw_pos[1]) > 1):
-            self._ale.act(action)
-            self._update_state()
+            with profiler.timer("ale.act"):
+                self._ale.act(action)
+            self._probe_state()
+            self._dirty_cells.add(self._ms_pacman_position)
+        self._update_state()
         self._update_map()
 
     def game_over(self):
         """Returns whether the game reached a terminal state or not."""
         return self._ale.game_over()
 
-    def reset_game(self):
-        """Resets the game to the initial state."""
-        self._reward = 0
-        return self._ale.reset_game()
+    def reset_game(self, rerandomize=False):
+        """Resets the game to the first decision point of an episode.
+
+        Args:
+            rerandomize: Whether to keep the emulator's random number
+                generator going instead of rewinding it, so that episodes
+                do not replay the same randomness.
+        """
+        self.restore_snapshot(self._start_snapshot, rerandomize)
+
+    def save_snapshot(self):
+        """Captures the current state of the game.
+
+        Returns:
+            GameSnapshot.
+        """
+        # The emulator only restores a state the way it was cloned, so both
+        # are kept for restore_snapshot() to pick from.
+        return GameSnapshot(self._ale.cloneState(),
+                            self._ale.cloneSystemState(), self._reward,
+                            self._blank_map.map.copy())
+
+    def restore_snapshot(self, snapshot, rerandomize=False):
+        """Restores the game to a snapshot.
+
+        Args:
+            snapshot: GameSnapshot.
+            rerandomize: Whether to keep the emulator's random number
+                generator going instead of restoring it from the snapshot.
+        """
+        if rerandomize:
+            self._ale.restoreState(snapshot.state)
+        else:
+            self._ale.restoreSystemState(snapshot.system_state)
+
+        self._reward = snapshot.reward
+        self._update_state()
+
+        # The emulator only redraws the screen on the next frame, so the map
+        # comes from the snapshot instead.
+        self._set_blank_map(GameMap.from_map(snapshot.blank_map.copy()))
+        self._map_updates = 0
+        self._dirty_cells.clear()
+        self._sliced_map = SlicedGameMap(self._map,
+                                         self._ms_pacman_position,
+                                         radius=self._radius)
 
-    def _to_map_position(self, pos):
+    @staticmethod
+    def _to_map_position(pos):
         """Converts a RAM coordinate into a map coordinate.
 
         Args:
@@ -189,7 +369,8 @@ class MsPacManGame(object):
             j = 10
         return i, j
 
-    def _to_raw_position(self, pos):
+    @staticmethod
+    def _to_raw_position(pos):
         i, j = pos
         y = i * 12 + 2
         if j == 0:
@@ -200,45 +381,115 @@ class MsPacManGame(object):
             x = (j - 1) * 8 + 22
         return x, y
 
+    @classmethod
+    def _build_position_tables(cls):
+        """Precomputes the map coordinates of every RAM coordinate."""
+        if cls._row_table is not None:
+            return
+
+        # Rows only depend on y and columns only on x.
+        cls._row_table = np.array([
+            cls._to_map_position((0, y))[0] for y in range(256)
+        ], dtype=np.int16)
+        cls._column_table = np.array([
+            cls._to_map_position((x, 0))[1] for x in range(256)
+        ], dtype=np.int16)
+
+    def _probe_state(self):
+        """Updates only Ms. PacMan's position and the lives from RAM.
+
+        This is all that is needed in between frames of the same action, the
+        other entities are decoded by _update_state() once it completes.
+        """
+        with profiler.timer("ram.probe"):
+            ram = self.__ram
+            self._ale.getRAM(ram)
+            x, y = int(ram[10]), int(ram[16])
+            self._raw_ms_pacman_position = (x, y)
+            self._ms_pacman_position = (int(self._row_table[y]),
+                                        int(self._column_table[x]))
+            self._lives = self._ale.lives()
+
     def _update_state(self):
         """Updates the internal state of the game."""
-        # Get new states from RAM.
-        self._ale.getRAM(self.__ram)
-        new_ms_pacman_position = (int(self.__ram[10]), int(self.__ram[16]))
-        new_ghosts_ram = [
-            ((int(self.__ram[6]), int(self.__ram[12])), int(self.__ram[1])),
-            ((int(self.__ram[7]), int(self.__ram[13])), int(self.__ram[2])),
-            ((int(self.__ram[8]), int(self.__ram[14])), int(self.__ram[3])),
-            ((int(self.__ram[9]), int(self.__ram[15])), int(self.__ram[4]))
-        ]
-        fruit = (int(self.__ram[11]), int(self.__ram[17])), int(self.__ram[5])
-        self._fruit = Fruit.from_ram(self._to_map_position(fruit[0]), fruit[1],
-                                     fruit[0][0] != 0)
-
-        # Update positions.
-        self._raw_ms_pacman_position = new_ms_pacman_position
-        self._ms_pacman_position = self._to_map_position(
-            new_ms_pacman_position)
-        self._ghosts = [
-            Ghost.from_ram(self._to_map_position(pos), ram)
-            for pos, ram in new_ghosts_ram
-        ]
+        with profiler.timer("ram.decode"):
+            # Get new states from RAM.
+            ram = self.__ram
+            self._ale.getRAM(ram)
+            self._entity_state.update(ram)
 
-        # Update lives.
-        self._lives = self._ale.lives()
+            # Update positions.
+            self._raw_ms_pacman_position = (int(ram[10]), int(ram[16]))
+            ms_pacman = self._entity_state.records[EntityState.MS_PACMAN]
+            self._ms_pacman_position = (ms_pacman[0], ms_pacman[1])
+
+            # Update lives.
+            self._lives = self._ale.lives()
 
     def _update_map(self):
-        # Get new map from screen.
+        """Updates the game map from the screen."""
         self._ale.getScreen(self.__screen)
-        self._map = GameMap(self.__screen.reshape(210, 160))
-        self._blank_map = GameMap.from_map(self._map.map.copy())
+        screen = self.__screen.reshape(210, 160)
+
+        # Resync the whole map periodically to avoid drifting, and whenever
+        # the maze was cleared since the next one looks entirely different.
+        if (self._incremental_map and
+                0 < self._map_updates < self.MAP_SYNC_INTERVAL and
+                self._blank_map.map.max() >= GameMapObjects.PELLET):
+            self._patch_map(screen)
+        else:
+            self._set_blank_map(GameMap(screen, wall_cache=self._wall_cache))
+            self._map_updates = 0
+
+        self._map_updates += 1
+        self._dirty_cells.clear()
+        self._sliced_map = SlicedGameMap(self._map,
+                                         self._ms_pacman_position,
+                                         radius=self._radius)
+
+    def _set_blank_map(self, blank_map):
+        """Replaces the game map.
+
+        Args:
+            blank_map: GameMap without any entity.
+        """
+        self._blank_map = blank_map
+        self._map = GameMap.from_map(blank_map.map.copy())
+        self._stamp_entities()
+
+    def _patch_map(self, screen):
+        """Reclassifies only the cells that might have changed in place.
+
+        Those are the cells Ms. PacMan went through, and the cells the other
+        entities were or are now on.
+
+        Args:
+            screen: Screen image.
+        """
+        dirty_cells = self._dirty_cells.union(self._stamped_cells)
+        dirty_cells.add(self._ms_pacman_position)
+        dirty_cells.add(self._fruit.position)
+        dirty_cells.update(ghost.position for ghost in self._ghosts)
+
+        # Negative indices wrap around the same way they do when stamping.
+        rows, columns = np.array(list(dirty_cells), dtype=int).T
+        cells = (rows % GameMap.HEIGHT, columns % GameMap.WIDTH)
+
+        with profiler.timer("map.reclassify"):
+            self._blank_map.reclassify(screen, cells)
+        self._map.map[cells] = self._blank_map.map[cells]
+        self._stamp_entities()
+
+    def _stamp_entities(self):
+        """Draws the entities onto the game map."""
+        self._stamped_cells = [self._ms_pacman_position]
         self._map.map[self._ms_pacman_position] = GameMapObjects.MS_PACMAN
         if self._fruit.exists:
+            self._stamped_cells.append(self._fruit.position)
             self._map.map[self._fruit.position] = GameMapObjects.FRUIT
         for ghost in self._ghosts:
             if ghost.state == Ghost.GOOD:
                 self._map.map[ghost.position] = GameMapObjects.GOOD_GHOST
             elif ghost.state == Ghost.BAD:
                 self._map.map[ghost.position] = GameMapObjects.BAD_GHOST
-        self._sliced_map = SlicedGameMap(self._map,
-                                         self._ms_pacman_position)
+            self._stamped_cells.append(ghost.position)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import socket
+import argparse
+import numbers
+import threading
+import numpy as np
+from learner import Learner
+from game_map import SlicedGameMap
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+def _is_integer(value):
+    """Tells whether a decoded JSON value is an integer, booleans aside."""
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    """Tells whether a decoded JSON value is a number, booleans aside."""
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+class ParameterServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    """Parameter server owning the weights and GLIE of remote actors.
+
+    Actors talk to the server over TCP with one JSON object per line:
+
+        {"op": "pull"}
+            Replies with the current {"weights", "weight_count", "glie",
+            "version"}.
+        {"op": "push", "delta": [...], "updates": n, "version": v}
+            Adds the weight delta an actor accumulated over n updates since
+            it pulled version v, unless more than max_staleness other
+            pushes were applied since. Replies like a pull, with whether
+            the delta was "accepted".
+        {"op": "episode", "score": s}
+            Records the score of a completed episode.
+
+    Invalid requests, e.g. deltas of another number of weights, are replied
+    to with {"error": message} instead.
+
+    Actors can join or leave at any time. The weights are persisted through
+    the Learner's own files.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, agent, max_staleness=10, save_interval=100):
+        """Constructs a ParameterServer.
+
+        Args:
+            address: (host, port) to listen on.
+            agent: Learner whose weights and GLIE to serve.
+            max_staleness: Maximum number of pushes applied in between an
+                actor's pull and push for its push to be accepted.
+            save_interval: Number of accepted pushes in between saves.
+        """
+        socketserver.TCPServer.__init__(self, address, _ActorHandler)
+        self.agent = agent
+        self.max_staleness = max_staleness
+        self.save_interval = save_interval
+
+        self.version = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.scores = []
+        self._lock = threading.Lock()
+
+    def _state(self):
+        """Returns the current weights, GLIE and version to send."""
+        return {
+            "weights": self.agent.weights.tolist(),
+            "weight_count": self.agent.weights.size,
+            "glie": self.agent.glie,
+            "version": self.version
+        }
+
+    def pull(self):
+        """Handles a pull request.
+
+        Returns:
+            Reply.
+        """
+        with self._lock:
+            return self._state()
+
+    def push(self, delta, updates, version):
+        """Handles a push request.
+
+        Args:
+            delta: List of weight changes.
+            updates: Number of updates the changes were accumulated over.
+            version: Version the changes are based on.
+
+        Returns:
+            Reply.
+        """
+        # Checked up front so that a bad request never updates part of the
+        # state.
+        if not _is_integer(updates) or updates < 0:
+            return {"error": "expected a non-negative integer number of "
+                             "updates, got {!r}".format(updates)}
+        if not _is_integer(version):
+            return {"error": "expected an integer version, got {!r}".format(
+                version)}
+        if not isinstance(delta, list) or not all(
+                _is_number(change) for change in delta):
+            return {"error": "expected a delta as a list of numbers"}
+        if len(delta) != self.agent.weights.size:
+            return {"error": "expected a delta of {} weights, got {}".format(
+                self.agent.weights.size, len(delta))}
+        delta = np.array(delta, dtype=np.float64)
+        if not np.all(np.isfinite(delta)):
+            return {"error": "expected a delta of finite numbers"}
+
+        with self._lock:
+            accepted = self.version - version <= self.max_staleness
+            if accepted:
+                self.agent.weights += delta
+                self.agent.weights_version += 1
+                self.agent.steps += updates
+                self.agent.glie = Learner.decay_glie(self.agent.glie,
+                                                     updates)
+                self.version += 1
+                self.accepted += 1
+                if self.accepted % self.save_interval == 0:
+                    self.agent.save()
+            else:
+                self.rejected += 1
+
+            reply = self._state()
+            reply["accepted"] = accepted
+            return reply
+
+    def episode(self, score):
+        """Handles a completed episode.
+
+        Args:
+            score: Score of the episode.
+
+        Returns:
+            Reply.
+        """
+        with self._lock:
+            self.scores.append(score)
+            self.agent.episodes += 1
+            print("Episode Complete {}: {}".format(len(self.scores), score))
+            print("Average: {}".format(
+                sum(self.scores) / float(len(self.scores))))
+            print("Max: {}".format(max(self.scores)))
+            print("Min: {}".format(min(self.scores)))
+            print("GLIE: {}".format(self.agent.glie))
+            print("Pushes: {} accepted, {} rejected".format(self.accepted,
+                                                            self.rejected))
+            return {}
+
+    def save(self):
+        """Saves the weights and GLIE."""
+        with self._lock:
+            self.agent.save()
+
+
+class _ActorHandler(socketserver.StreamRequestHandler):
+
+    """Handles the requests of a single actor connection."""
+
+    def _dispatch(self, request):
+        """Handles a request.
+
+        Args:
+            request: Decoded request.
+
+        Returns:
+            Reply.
+        """
+        op = request["op"]
+        if op == "pull":
+            return self.server.pull()
+        elif op == "push":
+            return self.server.push(request["delta"], request["updates"],
+                                    request["version"])
+        elif op == "episode":
+            return self.server.episode(request["score"])
+        raise ValueError("Unknown op: {}".format(op))
+
+    def handle(self):
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error:
+                # The actor died.
+                return
+            if not line:
+                return
+
+            try:
+                reply = self._dispatch(json.loads(line.decode("utf-8")))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                reply = {"error": "invalid request: {!r}".format(line)}
+
+            try:
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except socket.error:
+                return
+
+
+class ParameterClient(object):
+
+    """Keeps an actor's Learner in sync with a ParameterServer.
+
+    The actor trains its own copy of the weights, and pushes the changes it
+    accumulated every sync_interval updates in exchange for the latest
+    weights. If the server cannot be reached or replies with an error, the
+    actor keeps training on its own copy and retries at the next
+    synchronization.
+    """
+
+    def __init__(self, address, agent, sync_interval=100, timeout=10.0):
+        """Constructs a ParameterClient and pulls the current weights.
+
+        Args:
+            address: (host, port) of the server.
+            agent: Learner of the actor.
+            sync_interval: Number of updates in between pushes.
+            timeout: Socket timeout in seconds.
+
+        Raises:
+            ValueError: If the server serves another number of weights,
+                e.g. for another radius or without distance features.
+        """
+        self.address = address
+        self.agent = agent
+        self.sync_interval = sync_interval
+        self.timeout = timeout
+
+        self._socket = None
+        self._file = None
+        self._version = 0
+        self._updates = 0
+        self._anchor = agent.weights.copy()
+
+        # A server that is down at startup is no different from one that
+        # goes down later on: the first push pulls its weights instead.
+        try:
+            reply = self._request({"op": "pull"})
+        except (socket.error, ValueError) as e:
+            print("Parameter server unreachable: {}".format(e))
+            return
+        if "error" in reply:
+            print("Parameter server error: {}".format(reply["error"]))
+            return
+        if reply["weight_count"] != agent.weights.size:
+            self._disconnect()
+            raise ValueError(
+                "Parameter server serves {} weights, but the actor has {}: "
+                "are --radius and --distance-features the same on both?"
+                .format(reply["weight_count"], agent.weights.size))
+        self._apply(reply)
+
+    def _connect(self):
+        """Connects to the server."""
+        self._socket = socket.create_connection(self.address, self.timeout)
+        self._file = self._socket.makefile("rwb")
+
+    def _disconnect(self):
+        """Drops the connection to the server."""
+        if self._socket is not None:
+            try:
+                self._file.close()
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+        self._file = None
+
+    def _request(self, request):
+        """Sends a request and waits for its reply.
+
+        Args:
+            request: Request.
+
+        Returns:
+            Reply.
+
+        Raises:
+            socket.error: If the server cannot be reached.
+        """
+        try:
+            if self._socket is None:
+                self._connect()
+            self._file.write((json.dumps(request) + "\n").encode("utf-8"))
+            self._file.flush()
+            line = self._file.readline()
+            if not line:
+                raise socket.error("Connection closed by parameter server")
+            return json.loads(line.decode("utf-8"))
+        except (socket.error, ValueError):
+            self._disconnect()
+            raise
+
+    def _apply(self, reply):
+        """Replaces the actor's weights and GLIE with the server's.
+
+        Args:
+            reply: Reply to a pull or push.
+        """
+        self.agent.weights[:] = reply["weights"]
+        self.agent.weights_version += 1
+        self.agent.glie = reply["glie"]
+        self._version = reply["version"]
+        self._anchor[:] = self.agent.weights
+        self._updates = 0
+
+    def step(self):
+        """Records an update of the actor, and synchronizes if due."""
+        self._updates += 1
+        if self._updates >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Pushes the accumulated changes and pulls the latest weights."""
+        if not self._updates:
+            return
+        try:
+            reply = self._request({
+                "op": "push",
+                "delta": (self.agent.weights - self._anchor).tolist(),
+                "updates": self._updates,
+                "version": self._version
+            })
+        except (socket.error, ValueError) as e:
+            print("Parameter server unreachable: {}".format(e))
+            return
+        if "error" in reply:
+            print("Parameter server error: {}".format(reply["error"]))
+            return
+        self._apply(reply)
+
+    def report_episode(self, score):
+        """Reports the score of a completed episode.
+
+        Args:
+            score: Score of the episode.
+        """
+        self.sync()
+        try:
+            reply = self._request({"op": "episode", "score": score})
+        except (socket.error, ValueError) as e:
+            print("Parameter server unreachable: {}".format(e))
+            return
+        if "error" in reply:
+            print("Parameter server error: {}".format(reply["error"]))
+
+    def close(self):
+        """Pushes the remaining changes and disconnects."""
+        self.sync()
+        self._disconnect()
+
+
+def parse_address(address):
+    """Parses a HOST:PORT address.
+
+    Args:
+        address: HOST:PORT string.
+
+    Returns:
+        (host, port) tuple.
+    """
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def get_args():
+    """Gets parsed command-line arguments.
+
+    Returns:
+        Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="serves Ms. Pac-Man weights to remote actors")
+    parser.add_argument("--address", default="localhost:5526",
+                        help="HOST:PORT to listen on")
+    parser.add_argument("--max-staleness", default=10, type=int,
+                        help="maximum number of pushes applied in between an "
+                             "actor's pull and push to accept its push")
+    parser.add_argument("--save-interval", default=100, type=int,
+                        help="number of accepted pushes in between saves")
+    parser.add_argument("--radius", default=SlicedGameMap.RADIUS, type=int,
+                        help="radius of the map slices of the actors")
+    parser.add_argument("--distance-features", action="store_true",
+                        default=False,
+                        help="serve the weights of maze distance features "
+                             "too, as actors using them expect")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    server = ParameterServer(parse_address(args.address),
+                             Learner(distance_features=args.distance_features,
+                                     radius=args.radius),
+                             args.max_staleness, args.save_interval)
+    print("Serving weights on {}:{}".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.save()
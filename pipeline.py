@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import profiler
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class EmulatorWorker(object):
+
+    """Plays the actions of a game from a background thread.
+
+    The emulator releases the interpreter lock while it runs frames, so the
+    caller can train on earlier steps in the meantime:
+
+        worker.act(action)
+        agent.update_weights(...)  # Only with frozen states.
+        reward = worker.wait()
+
+    The game must not be used in between act() and wait(). Only the
+    emulator's own frames overlap with training: the map updates of the game
+    still hold the interpreter lock, so this only pays off when training
+    takes a large share of each step.
+    """
+
+    def __init__(self, game):
+        """Constructs an EmulatorWorker and starts its thread.
+
+        Args:
+            game: MsPacManGame.
+        """
+        self.game = game
+        self._actions = queue.Queue(maxsize=1)
+        self._results = queue.Queue(maxsize=1)
+        self._busy = False
+
+        self._thread = threading.Thread(target=self._run, name="emulator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def act(self, action):
+        """Starts playing an action.
+
+        Args:
+            action: Action to play.
+
+        Raises:
+            RuntimeError: If the previous action was not waited for.
+        """
+        if self._busy:
+            raise RuntimeError("the previous action is still being played")
+        self._busy = True
+        self._actions.put(action)
+
+    def wait(self):
+        """Waits for the action being played to finish.
+
+        Returns:
+            Reward gained by the action.
+
+        Raises:
+            Exception: Whatever the game raised while playing the action.
+        """
+        with profiler.timer("pipeline.wait"):
+            reward, error = self._results.get()
+        self._busy = False
+        if error is not None:
+            raise error
+        return reward
+
+    def close(self):
+        """Stops the thread."""
+        if self._busy:
+            self.wait()
+        self._actions.put(None)
+        self._thread.join()
+
+    def _run(self):
+        """Plays actions until closed."""
+        while True:
+            action = self._actions.get()
+            if action is None:
+                break
+            try:
+                with profiler.timer("act"):
+                    reward = self.game.act(action)
+                self._results.put((reward, None))
+            except Exception as e:
+                self._results.put((None, e))
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import profiler
+import numpy as np
+import bitboard
+from map_proc import get_slice
+from bitboard import Bitboard, get_bit
+from game_map import GameMap
+from game_map_objects import GameMapObjects, Ghost
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class _Timeout(Exception):
+
+    """Raised when a search runs out of time."""
+
+
+class Planner(object):
+
+    """Time-budgeted lookahead planner over the full game map.
+
+    Searches every sequence of moves up to some depth, predicting where the
+    ghosts go, and scores the states reached with the learner's utility. The
+    search deepens one move at a time until the time budget of the decision
+    runs out, and plays the best move of the deepest completed search.
+
+    States are (Ms. PacMan's position, ghosts, fruit) tuples along with a
+    bitboard mask of the pellets and power-ups eaten since the root, which
+    together key a transposition table of the values searched so far.
+    """
+
+    # Actions and moves of Ms. PacMan, as in GameState.available_actions().
+    MOVES = [
+        (2, (-1, 0)),  # up
+        (3, (0, 1)),   # right
+        (4, (0, -1)),  # left
+        (5, (1, 0))    # down
+    ]
+
+    # Number of nodes in between checks of the time budget.
+    CHECK_INTERVAL = 64
+
+    def __init__(self, agent, budget=0.01, max_depth=20):
+        """Constructs a Planner.
+
+        Args:
+            agent: Learner to evaluate states and explore with.
+            budget: Number of seconds to search each decision for. The first
+                move is always searched to completion.
+            max_depth: Maximum number of moves to search ahead.
+        """
+        self.agent = agent
+        self.budget = budget
+        self.max_depth = max_depth
+
+        self.decisions = 0
+        self.nodes = 0
+        self.elapsed = 0.0
+        self.total_depth = 0
+        self.max_depth_reached = 0
+
+        # Open neighbors of every cell, and ghost moves of every cell and
+        # direction, by wall layout.
+        self._neighbor_tables = {}
+
+        self._work_map = None
+        self._game_map = None
+        self._radius = None
+        self._pellets = 0
+        self._power_ups = 0
+        self._neighbors = None
+        self._ghost_options = None
+        self._table = {}
+        self._node_count = 0
+        self._deadline = None
+
+    def __str__(self):
+        return ("Planner: {} decisions, {:.1f} mean depth, {} max depth, "
+                "{:.0f} nodes/s").format(self.decisions, self.mean_depth,
+                                         self.max_depth_reached,
+                                         self.nodes_per_second)
+
+    @property
+    def mean_depth(self):
+        """Mean depth of the completed searches."""
+        return self.total_depth / float(self.decisions) \
+            if self.decisions else 0.0
+
+    @property
+    def nodes_per_second(self):
+        """Number of nodes searched per second."""
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def get_optimal_action(self, game):
+        """Chooses an action, exploring like the learner does.
+
+        Args:
+            game: MsPacManGame or GameState.
+
+        Returns:
+            Tuple of (action, the learner's utility of the action), as
+            returned by Learner.get_optimal_action().
+        """
+        available_actions = game.available_actions()
+        if not available_actions:
+            return 0, float("-inf")  # noop.
+
+        if random.random() <= self.agent.glie:
+            action = random.choice(available_actions)
+        else:
+            with profiler.timer("plan"):
+                action = self.plan(game, available_actions)
+        return action, self.agent.get_action_utility(game, action)
+
+    def plan(self, game, actions):
+        """Searches for the best action by iterative deepening.
+
+        Args:
+            game: MsPacManGame or GameState.
+            actions: Available actions.
+
+        Returns:
+            Best action of the deepest completed search.
+        """
+        start = _clock()
+        self._set_root(game)
+        pos = game.ms_pacman_position
+        ghosts = tuple(sorted(
+            (ghost.position, ghost.direction, ghost.state)
+            for ghost in game.ghosts
+        ))
+        fruit = game.fruit.position if game.fruit.exists else None
+
+        children = []
+        for action in actions:
+            move = game.action_to_move(action)
+            new_pos = game.get_next_position(pos, move)
+            children.append(
+                (action, self._step(ghosts, fruit, new_pos)))
+
+        best_action = actions[0]
+        depth = 0
+        self._deadline = None
+        try:
+            while depth < self.max_depth:
+                values = [
+                    self._search(child, 0, depth)
+                    for _, child in children
+                ]
+                best_value = max(values)
+                best_action = random.choice([
+                    action for (action, _), value in zip(children, values)
+                    if value == best_value
+                ])
+                depth += 1
+
+                # Only deeper searches can run out of time, so that there
+                # always is a move to play.
+                self._deadline = start + self.budget
+                if _clock() >= self._deadline:
+                    break
+        except _Timeout:
+            pass
+
+        self.decisions += 1
+        self.nodes += self._node_count
+        self.elapsed += _clock() - start
+        self.total_depth += depth
+        self.max_depth_reached = max(self.max_depth_reached, depth)
+        return best_action
+
+    def _set_root(self, game):
+        """Prepares the search of a decision.
+
+        Args:
+            game: MsPacManGame or GameState.
+        """
+        self._work_map = game.blank_map.map.copy()
+        self._game_map = GameMap.from_map(self._work_map)
+        self._radius = game.sliced_map.radius
+        board = Bitboard.from_map(self._work_map)
+        self._pellets = board.masks[GameMapObjects.PELLET]
+        self._power_ups = board.masks[GameMapObjects.POWER_UP]
+
+        walls = board.masks[GameMapObjects.WALL]
+        tables = self._neighbor_tables.get(walls)
+        if tables is None:
+            tables = self._neighbor_tables[walls] = \
+                (self._get_neighbors(walls), {})
+        self._neighbors, self._ghost_options = tables
+        self._table = {}
+        self._node_count = 0
+
+    @classmethod
+    def _get_neighbors(cls, walls):
+        """Lists the open neighbors of every cell.
+
+        Args:
+            walls: Bitboard mask of the walls.
+
+        Returns:
+            Dictionary of cell to a list of (action, move, neighbor) tuples.
+        """
+        paths = bitboard.FULL & ~walls
+        neighbors = {}
+        for position in bitboard.iter_positions(bitboard.FULL):
+            neighbors[position] = [
+                (action, move, bitboard.get_position(
+                    bitboard.shift(get_bit(position), move)))
+                for action, move in cls.MOVES
+                if bitboard.shift(get_bit(position), move) & paths
+            ]
+        return neighbors
+
+    def _move_ghost(self, position, direction, state, target):
+        """Predicts a ghost's next move.
+
+        Ghosts keep going along corridors without turning back. At
+        junctions, dangerous ghosts take the shortest way towards Ms. PacMan
+        and edible ones the longest.
+
+        Args:
+            position: Ghost's position.
+            direction: Ghost's direction.
+            state: Ghost's state.
+            target: Ms. PacMan's position.
+
+        Returns:
+            Tuple of the ghost's next (position, direction).
+        """
+        key = (position, direction)
+        options = self._ghost_options.get(key)
+        if options is None:
+            options = self._ghost_options[key] = \
+                self._get_ghost_options(position, direction)
+        if len(options) == 1:
+            return options[0]
+
+        width = GameMap.WIDTH
+        best_option = None
+        best_distance = None
+        for option in options:
+            neighbor, move = option
+            columns = abs(neighbor[1] - target[1])
+            distance = (abs(neighbor[0] - target[0]) +
+                        min(columns, width - columns))
+            if state == Ghost.GOOD:
+                distance = -distance
+            if (best_option is None or distance < best_distance or
+                    distance == best_distance and move == direction):
+                best_option = option
+                best_distance = distance
+        return best_option
+
+    def _get_ghost_options(self, position, direction):
+        """Lists the moves a ghost can choose from.
+
+        Args:
+            position: Ghost's position.
+            direction: Ghost's direction.
+
+        Returns:
+            Non-empty list of (next position, direction) tuples.
+        """
+        neighbors = self._neighbors.get(position)
+        if not neighbors:
+            # Off the map or boxed in.
+            return [(position, direction)]
+
+        reverse = (-direction[0], -direction[1])
+        options = [
+            (neighbor, move) for _, move, neighbor in neighbors
+            if move != reverse
+        ]
+        if not options:
+            options = [(neighbor, move) for _, move, neighbor in neighbors]
+        return options
+
+    def _step(self, ghosts, fruit, new_pos):
+        """Moves Ms. PacMan and the ghosts one step.
+
+        Args:
+            ghosts: Sorted tuple of (position, direction, state) tuples.
+            fruit: Fruit's position, or None.
+            new_pos: Ms. PacMan's next position.
+
+        Returns:
+            Next state.
+        """
+        moved = []
+        for position, direction, state in ghosts:
+            if position != new_pos:
+                position, direction = self._move_ghost(position, direction,
+                                                       state, new_pos)
+            moved.append((position, direction, state))
+        return new_pos, tuple(sorted(moved)), fruit
+
+    def _check_time(self):
+        """Raises _Timeout once the time budget runs out."""
+        self._node_count += 1
+        if (self._deadline is not None and
+                self._node_count % self.CHECK_INTERVAL == 0 and
+                _clock() >= self._deadline):
+            raise _Timeout()
+
+    def _search(self, state, eaten, depth):
+        """Computes the value of a state.
+
+        Args:
+            state: State just moved into, before eating anything.
+            eaten: Bitboard mask of the cells eaten since the root.
+            depth: Number of moves to search past this state.
+
+        Returns:
+            Learner's utility of the state if it is a leaf, and otherwise
+            the reward of the state plus the discounted value of the best
+            next state.
+        """
+        key = (state, eaten)
+        entry = self._table.get(key)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+
+        pos, ghosts, fruit = state
+        dead = any(
+            position == pos and ghost_state == Ghost.BAD
+            for position, _, ghost_state in ghosts
+        )
+        if dead or depth == 0:
+            value = self._evaluate([state], eaten)[0]
+            self._table[key] = (self.max_depth if dead else depth, value)
+            return value
+        self._check_time()
+
+        # Eat whatever is there.
+        bit = get_bit(pos) & ~eaten
+        reward = 0
+        powered = False
+        if bit & self._pellets:
+            reward += GameMapObjects.to_reward(GameMapObjects.PELLET)
+            eaten |= bit
+        elif bit & self._power_ups:
+            reward += GameMapObjects.to_reward(GameMapObjects.POWER_UP)
+            eaten |= bit
+            powered = True
+        if fruit == pos:
+            reward += GameMapObjects.to_reward(GameMapObjects.FRUIT)
+            fruit = None
+        remaining = []
+        for ghost in ghosts:
+            if ghost[0] == pos:
+                reward += GameMapObjects.to_reward(GameMapObjects.GOOD_GHOST)
+            elif powered:
+                remaining.append((ghost[0], ghost[1], Ghost.GOOD))
+            else:
+                remaining.append(ghost)
+        ghosts = tuple(remaining)
+
+        children = [
+            self._step(ghosts, fruit, new_pos)
+            for _, _, new_pos in self._neighbors[pos]
+        ]
+        if not children:
+            value = self._evaluate([state], eaten)[0]
+        elif depth == 1:
+            # Score the leaves all at once.
+            value = reward + self.agent.gamma * max(
+                self._evaluate(children, eaten))
+        else:
+            value = reward + self.agent.gamma * max(
+                self._search(child, eaten, depth - 1) for child in children)
+        self._table[key] = (depth, value)
+        return value
+
+    def _evaluate(self, states, eaten):
+        """Scores leaf states with the learner's utility.
+
+        Args:
+            states: States just moved into, before eating anything.
+            eaten: Bitboard mask of the cells eaten since the root.
+
+        Returns:
+            List of utilities.
+        """
+        values = [None] * len(states)
+        missing = []
+        for k, state in enumerate(states):
+            entry = self._table.get((state, eaten))
+            if entry is None:
+                missing.append(k)
+            else:
+                values[k] = entry[1]
+
+        if missing:
+            for _ in missing:
+                self._check_time()
+            utilities = self.agent.get_state_utilities(np.array([
+                self._get_slice(states[k], eaten) for k in missing
+            ]))
+            for k, utility in zip(missing, utilities.tolist()):
+                values[k] = utility
+                self._table.setdefault((states[k], eaten), (0, utility))
+        return values
+
+    def _get_slice(self, state, eaten):
+        """Slices the map of a state around Ms. PacMan.
+
+        Args:
+            state: State just moved into, before eating anything.
+            eaten: Bitboard mask of the cells eaten since the root.
+
+        Returns:
+            Map slice matrix.
+        """
+        pos, ghosts, fruit = state
+        work_map = self._work_map
+        height, width = work_map.shape
+
+        # Draw what was eaten, the fruit and the ghosts as in
+        # transition_model, then undo it.
+        drawn = []
+        for position in bitboard.iter_positions(eaten):
+            drawn.append((position, work_map[position]))
+            work_map[position] = GameMapObjects.EMPTY
+        if fruit is not None and 0 <= fruit[0] < height:
+            drawn.append((fruit, work_map[fruit]))
+            work_map[fruit] = GameMapObjects.FRUIT
+        for position, _, ghost_state in ghosts:
+            if 0 <= position[0] < height and 0 <= position[1] < width:
+                drawn.append((position, work_map[position]))
+                work_map[position] = \
+                    GameMapObjects.GOOD_GHOST if ghost_state == Ghost.GOOD \
+                    else GameMapObjects.BAD_GHOST
+        state_slice = get_slice(self._game_map, pos, self._radius)
+        for position, cell in reversed(drawn):
+            work_map[position] = cell
+        return state_slice
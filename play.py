@@ -1,10 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import cv2
+import sys
+import atexit
+import collections
 import argparse
+import profiler
 from learner import Learner
+from checkpoint import Checkpointer
+from display import MapDisplay
+from metrics import Metrics, NullMetrics
+from actor_pool import ActorPool
+from param_server import ParameterClient, parse_address
+from game_map import SlicedGameMap
 from ms_pacman import MsPacManGame
+from planner import Planner
+from pipeline import EmulatorWorker
+from replay_buffer import ExperienceReplay
+from transition_model import get_next_state
+from trajectory import ReplayGame, TraceWriter, load_trace
 
 
 def get_args():
@@ -25,52 +39,323 @@ def get_args():
                         dest="display")
     parser.add_argument("--map-display", action="store_true", default=False,
                         help="whether to display the map on screen or not")
+    parser.add_argument("--map-display-fps", default=30.0, type=float,
+                        help="maximum number of map display refreshes per "
+                             "second, older maps are skipped")
     parser.add_argument("--seed", default=None, type=int,
                         help="seed for random number generator to use")
+    parser.add_argument("--utility-cache-size", default=0, type=int,
+                        help="number of state utilities to cache, "
+                             "0 to disable (faster with --no-learn)")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="number of games to play in parallel "
+                             "processes, without display")
+    parser.add_argument("--weight-sync", default=ActorPool.ASYNC,
+                        choices=ActorPool.MODES,
+                        help="how parallel workers share their weights: "
+                             "lock-free updates or periodic averaging")
+    parser.add_argument("--sync-interval", default=100, type=int,
+                        help="number of updates in between averaging the "
+                             "weights of parallel workers, or in between "
+                             "synchronizing with the parameter server")
+    parser.add_argument("--parameter-server", default=None,
+                        metavar="HOST:PORT",
+                        help="train against the weights of a parameter "
+                             "server (see param_server.py)")
+    parser.add_argument("--incremental-map", action="store_true",
+                        default=False,
+                        help="only reclassify the map cells that changed "
+                             "in between periodic full map updates (faster)")
+    parser.add_argument("--checkpoint-steps", default=0, type=int,
+                        help="number of updates in between checkpoints on "
+                             "top of the one after every episode, "
+                             "0 to disable")
+    parser.add_argument("--checkpoint-seconds", default=0, type=float,
+                        help="number of seconds in between checkpoints on "
+                             "top of the one after every episode, "
+                             "0 to disable")
+    parser.add_argument("--checkpoint-retention",
+                        default=Learner.CHECKPOINT_RETENTION, type=int,
+                        help="number of checkpoint files to keep")
+    parser.add_argument("--quiet", action="store_true", default=False,
+                        help="do not print anything to the console")
+    parser.add_argument("--metrics-file", default=None,
+                        help="file to write training metrics to, as CSV if "
+                             "it ends with .csv and JSON lines otherwise")
+    parser.add_argument("--metrics-interval", default=10.0, type=float,
+                        help="number of seconds in between metrics writes")
+    parser.add_argument("--console-interval", default=5.0, type=float,
+                        help="minimum number of seconds in between console "
+                             "summaries")
+    parser.add_argument("--profile", action="store_true", default=False,
+                        help="time the phases of every decision and print "
+                             "a report at exit")
+    parser.add_argument("--profile-file", default=None,
+                        help="file to also write the profile to as JSON")
+    parser.add_argument("--record", default=None, metavar="TRACE",
+                        help="append every decision to a trace file")
+    parser.add_argument("--replay", nargs="+", default=None,
+                        metavar="TRACE",
+                        help="train on, or evaluate against with "
+                             "--no-learn, recorded traces instead of playing")
+    parser.add_argument("--rerandomize-reset", action="store_true",
+                        default=False,
+                        help="keep the emulator's randomness going across "
+                             "episodes instead of replaying the first one's")
+    parser.add_argument("--radius", default=SlicedGameMap.RADIUS, type=int,
+                        help="radius of the map slice around Ms. PacMan the "
+                             "agent sees, with checkpoints of its own")
+    parser.add_argument("--distance-features", action="store_true",
+                        default=False,
+                        help="also learn from the maze distances to the "
+                             "nearest pellet, power-up and ghosts")
+    parser.add_argument("--plan-budget", default=0, type=float,
+                        help="number of seconds to search moves ahead for "
+                             "every decision, 0 to only look one move ahead")
+    parser.add_argument("--plan-depth", default=20, type=int,
+                        help="maximum number of moves to search ahead")
+    parser.add_argument("--pipeline-staleness", default=0, type=int,
+                        help="number of steps the weights used to decide "
+                             "may lag behind, so that the emulator plays "
+                             "while the agent trains on earlier steps, "
+                             "0 to train on every step before the next one "
+                             "(experimental: only faster when training is "
+                             "slow compared to emulation)")
+    parser.add_argument("--replay-capacity", default=0, type=int,
+                        help="number of past transitions to also train on "
+                             "in mini-batches, 0 to disable")
+    parser.add_argument("--replay-batch-size", default=32, type=int,
+                        help="number of past transitions per mini-batch")
+    parser.add_argument("--replay-ratio", default=1.0, type=float,
+                        help="number of mini-batches per step, may be "
+                             "fractional")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.checkpoint_retention < 1:
+        parser.error("--checkpoint-retention must be at least 1")
+    if args.workers > 1:
+        # Parallel workers only play and learn one step at a time.
+        unsupported = [
+            ("--record", args.record),
+            ("--replay", args.replay),
+            ("--parameter-server", args.parameter_server),
+            ("--plan-budget", args.plan_budget),
+            ("--replay-capacity", args.replay_capacity),
+            ("--pipeline-staleness", args.pipeline_staleness),
+            ("--map-display", args.map_display),
+            ("--profile", args.profile)
+        ]
+        for flag, value in unsupported:
+            if value:
+                parser.error("{} is not supported with --workers".format(
+                    flag))
+    return args
+
+
+def report_profile(path=None):
+    """Prints the profile, and writes it to a file if any.
+
+    Args:
+        path: Path of the JSON file to write.
+    """
+    print(profiler.report())
+    if path is not None:
+        profiler.dump(path)
+
+
+def train(agent, transition, experience, metrics, sync):
+    """Trains an agent on a step.
+
+    Args:
+        agent: Learner.
+        transition: Tuple of (previous slice, action, predicted slice of the
+            action, game after the action, expected utility, reward).
+        experience: ExperienceReplay to also train with, if any.
+        metrics: Metrics sink.
+        sync: Checkpointer or ParameterClient to step.
+    """
+    prev_state, action, chosen_state, game, expected_utility, reward = \
+        transition
+    with profiler.timer("learner.update"):
+        actual_utility, error = agent.update_weights(
+            prev_state, action, game, expected_utility, reward)
+    if experience is not None:
+        with profiler.timer("learner.replay"):
+            experience.observe(prev_state, action, chosen_state, game,
+                               reward)
+    metrics.step(reward, expected_utility, actual_utility, error, agent.glie)
+    sync.step()
+
+
+def replay(agent, paths, learn, metrics, checkpointer):
+    """Trains or evaluates an agent on the decisions of recorded traces.
+
+    Args:
+        agent: Learner.
+        paths: Paths of the trace files.
+        learn: Whether to train or only evaluate.
+        metrics: Metrics sink.
+        checkpointer: Checkpointer to save the agent with.
+    """
+    for path in paths:
+        records = load_trace(path)
+        if records["sliced_map"].shape[-1] != 2 * agent.radius + 1:
+            raise ValueError("{} was recorded with another slice radius than "
+                             "{}".format(path, agent.radius))
+        for transitions in ReplayGame(records).episodes():
+            for state, action, reward, next_state in transitions:
+                expected_utility = agent.get_action_utility(state, action)
+                if learn:
+                    actual_utility, error = agent.update_weights(
+                        state.sliced_map.map, action, next_state,
+                        expected_utility, reward)
+                    checkpointer.step()
+                else:
+                    actual_utility = agent.get_observed_utility(next_state,
+                                                                reward)
+                    error = 0.5 * (actual_utility - expected_utility) ** 2
+                metrics.step(reward, expected_utility, actual_utility, error,
+                             agent.glie)
+
+            metrics.episode(transitions[-1][3].reward)
+            if learn:
+                agent.episodes += 1
+                checkpointer.save()
 
 
 if __name__ == "__main__":
     args = get_args()
-    game = MsPacManGame(args.seed, args.display)
-    agent = Learner(args.learning_rate)
+    if args.profile:
+        profiler.enable()
+        atexit.register(report_profile, args.profile_file)
+
+    agent = Learner(args.learning_rate,
+                    cache_size=args.utility_cache_size,
+                    read_only=args.no_learn,
+                    distance_features=args.distance_features,
+                    radius=args.radius)
+
+    agent.restore_rng()
+    checkpointer = Checkpointer(agent, args.checkpoint_steps,
+                                args.checkpoint_seconds,
+                                args.checkpoint_retention)
+
+    if args.quiet and args.metrics_file is None:
+        metrics = NullMetrics()
+    else:
+        metrics = Metrics(args.metrics_file, args.metrics_interval,
+                          None if args.quiet else args.console_interval)
+
+    if args.workers > 1:
+        pool = ActorPool(args.workers, agent, args.weight_sync,
+                         args.sync_interval, not args.no_learn,
+                         args.incremental_map, args.utility_cache_size,
+                         args.rerandomize_reset)
+        pool.run(args.episodes, args.seed, checkpointer, metrics, args.quiet)
+        metrics.close()
+        sys.exit(0)
+
+    if args.replay:
+        replay(agent, args.replay, not args.no_learn, metrics, checkpointer)
+        metrics.close()
+        sys.exit(0)
+
+    game = MsPacManGame(args.seed, args.display, args.incremental_map,
+                        radius=args.radius)
+
+    client = None
+    if args.parameter_server and not args.no_learn:
+        client = ParameterClient(parse_address(args.parameter_server), agent,
+                                 args.sync_interval)
+
+    writer = None
+    if args.record:
+        writer = TraceWriter(args.record, 2 * args.radius + 1)
+
+    policy = agent
+    planner = None
+    if args.plan_budget > 0:
+        policy = planner = Planner(agent, args.plan_budget, args.plan_depth)
+
+    experience = None
+    if args.replay_capacity and not args.no_learn:
+        experience = ExperienceReplay(agent, args.replay_capacity,
+                                      args.replay_batch_size,
+                                      args.replay_ratio)
+
+    display = None
+    if args.map_display:
+        display = MapDisplay(args.map_display_fps)
+
+    sync = client if client is not None else checkpointer
+    emulator = None
+    if args.pipeline_staleness > 0 and not args.no_learn:
+        emulator = EmulatorWorker(game)
+    pending = collections.deque()
 
-    total_rewards = 0
-    min_rewards = float("inf")
-    max_rewards = 0
     for episode in range(args.episodes):
+        if writer is not None:
+            writer.start(game)
         while not game.game_over():
-            print("Episode {}: {}".format(episode + 1, game.reward))
-            if episode:
-                print("Average: {}".format(total_rewards / episode))
-            max_rewards = max(max_rewards, game.reward)
-            print("Max: {}".format(max_rewards))
-            print("Min: {}".format(min_rewards))
-
             prev_state = game.sliced_map.map
-            optimal_a, expected_utility = agent.get_optimal_action(game)
-            reward = game.act(optimal_a)
+            with profiler.timer("decide"):
+                optimal_a, expected_utility = policy.get_optimal_action(game)
+            chosen_state = None
+            if experience is not None:
+                chosen_state = get_next_state(game, optimal_a)
+
+            if emulator is None:
+                with profiler.timer("act"):
+                    reward = game.act(optimal_a)
+            else:
+                # Train on earlier steps while the emulator plays this one.
+                emulator.act(optimal_a)
+                while len(pending) >= args.pipeline_staleness:
+                    train(agent, pending.popleft(), experience, metrics,
+                          sync)
+                reward = emulator.wait()
+
+            if writer is not None:
+                writer.step(game, optimal_a, reward)
+
+            if args.no_learn:
+                metrics.step(reward, expected_utility)
+            elif emulator is None:
+                train(agent, (prev_state, optimal_a, chosen_state, game,
+                              expected_utility, reward),
+                      experience, metrics, sync)
+            else:
+                pending.append((prev_state, optimal_a, chosen_state,
+                                game.freeze(), expected_utility, reward))
 
-            if not args.no_learn:
-                print(agent.human_readable_weights())
-                agent.update_weights(prev_state, optimal_a, game,
-                                     expected_utility, reward)
+            if display is not None:
+                display.submit(game)
 
-            if args.map_display:
-                game_map = game.map
-                sliced_game_map = game.sliced_map
+        while pending:
+            train(agent, pending.popleft(), experience, metrics, sync)
 
-                cv2.imshow("map", game_map.to_image())
-                cv2.imshow("sliced map", sliced_game_map.to_image())
-                cv2.waitKey(1)
+        metrics.episode(game.reward)
+        if not args.quiet:
+            print("GLIE: {}".format(agent.glie))
+            if agent.utility_cache is not None:
+                print(agent.utility_cache)
+            if planner is not None:
+                print(planner)
+        agent.episodes += 1
 
-        print("Episode Complete {}: {}".format(episode + 1, game.reward))
-        print("GLIE: {}".format(agent.glie))
-        min_rewards = min(min_rewards, game.reward)
-        total_rewards += game.reward
+        if client is not None:
+            client.report_episode(game.reward)
+        elif not args.no_learn:
+            checkpointer.save()
 
-        if not args.no_learn:
-            agent.save()
+        game.reset_game(args.rerandomize_reset)
 
-        game.reset_game()
+    metrics.close()
+    if writer is not None:
+        writer.close()
+    if client is not None:
+        client.close()
+    if display is not None:
+        display.close()
+    if emulator is not None:
+        emulator.close()
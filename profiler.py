@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import math
+import json
+import time
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class LatencyHistogram(object):
+
+    """Histogram of durations with logarithmically spaced buckets."""
+
+    # Upper bound of the first bucket in seconds.
+    MIN_DURATION = 1e-7
+
+    # Number of buckets each time the duration doubles, i.e. a resolution
+    # of about 9%.
+    BUCKETS_PER_OCTAVE = 8
+
+    def __init__(self):
+        """Constructs an empty LatencyHistogram."""
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self._buckets = {}
+
+    def add(self, duration):
+        """Adds a duration.
+
+        Args:
+            duration: Duration in seconds.
+        """
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum:
+            self.maximum = duration
+
+        bucket = 0
+        if duration > self.MIN_DURATION:
+            bucket = int(math.ceil(math.log(duration / self.MIN_DURATION, 2) *
+                                   self.BUCKETS_PER_OCTAVE))
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def _upper_bound(self, bucket):
+        """Returns the longest duration of a bucket."""
+        return self.MIN_DURATION * 2 ** (bucket /
+                                         float(self.BUCKETS_PER_OCTAVE))
+
+    def percentile(self, q):
+        """Estimates a percentile of the durations.
+
+        Args:
+            q: Percentile between 0 and 100.
+
+        Returns:
+            Upper bound of the bucket the percentile falls in, in seconds.
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(self._upper_bound(bucket), self.maximum)
+        return self.maximum
+
+    @property
+    def mean(self):
+        """Mean duration in seconds."""
+        return self.total / self.count if self.count else 0.0
+
+
+class _Timer(object):
+
+    """Context manager adding the time spent within it to a histogram."""
+
+    def __init__(self):
+        """Constructs a _Timer."""
+        self.histogram = LatencyHistogram()
+        self._starts = []
+
+    def __enter__(self):
+        self._starts.append(_clock())
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.add(_clock() - self._starts.pop())
+        return False
+
+
+class _NullTimer(object):
+
+    """Context manager that does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+_enabled = False
+_timers = {}
+
+
+def enable():
+    """Starts timing."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops timing."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """Returns whether timing is enabled."""
+    return _enabled
+
+
+def reset():
+    """Forgets every timing so far."""
+    _timers.clear()
+
+
+def timer(name):
+    """Gets the timer of a phase.
+
+    Timers are disabled by default, in which case a shared context manager
+    that does nothing is returned:
+
+        with profiler.timer("ale.act"):
+            reward = ale.act(action)
+
+    Args:
+        name: Name of the phase.
+
+    Returns:
+        Context manager timing its body.
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    phase_timer = _timers.get(name)
+    if phase_timer is None:
+        phase_timer = _timers[name] = _Timer()
+    return phase_timer
+
+
+def get_stats():
+    """Summarizes the timings of every phase.
+
+    Returns:
+        Dictionary of phase name to a dictionary of call count, total, mean,
+        p50, p95, p99 and max durations in seconds.
+    """
+    stats = {}
+    for name, phase_timer in _timers.items():
+        histogram = phase_timer.histogram
+        stats[name] = {
+            "calls": histogram.count,
+            "total": histogram.total,
+            "mean": histogram.mean,
+            "p50": histogram.percentile(50),
+            "p95": histogram.percentile(95),
+            "p99": histogram.percentile(99),
+            "max": histogram.maximum
+        }
+    return stats
+
+
+def report():
+    """Formats the timings of every phase as a table.
+
+    Returns:
+        Report string, with the phases taking the most time first.
+    """
+    stats = get_stats()
+    lines = ["{:<20} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "phase", "calls", "total (s)", "p50 (ms)", "p95 (ms)", "p99 (ms)",
+        "max (ms)")]
+    for name in sorted(stats, key=lambda n: -stats[n]["total"]):
+        phase = stats[name]
+        lines.append(
+            "{:<20} {:>9} {:>10.3f} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}"
+            .format(name, phase["calls"], phase["total"],
+                    phase["p50"] * 1e3, phase["p95"] * 1e3,
+                    phase["p99"] * 1e3, phase["max"] * 1e3))
+    return "\n".join(lines)
+
+
+def dump(path):
+    """Writes the timings of every phase as JSON.
+
+    Args:
+        path: Path of the file to write.
+    """
+    with open(path, "w") as f:
+        json.dump(get_stats(), f, indent=2, sort_keys=True)
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import random
+import argparse
+import numpy as np
+from learner import Learner
+from ms_pacman import MsPacManGame
+from collections import deque
+from map_proc import get_slice, get_slices
+from game_map import GameMap, WallLayoutCache
+from transition_model import get_next_states
+from game_map_objects import GameMapObjects
+from fake_ale import FakeALEInterface, load_fixture
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+DEFAULT_FIXTURE = os.path.join(FIXTURES_DIR, "synthetic.npz")
+
+# Maximum number of differences to print per check.
+MAX_REPORTED = 5
+
+# Slice radii to check, the default one and a larger one.
+RADII = (2, 3)
+
+
+class _RegressionLearner(Learner):
+
+    """Learner starting from the default weights, ignoring saved ones."""
+
+    # None of these exist.
+    CHECKPOINT_PREFIX = os.path.join(FIXTURES_DIR, "no-checkpoint")
+    WEIGHTS_FILE = os.path.join(FIXTURES_DIR, "no-weights.p")
+    GLIE_FILE = os.path.join(FIXTURES_DIR, "no-glie.p")
+
+
+def reference_classify(image):
+    """Classifies a screen partition by partition, as originally written.
+
+    Counting the primary color stands in for the original OpenCV histogram.
+
+    Args:
+        image: Screen image.
+
+    Returns:
+        HEIGHT x WIDTH map of GameMapObjects.
+    """
+    image = image[2:170]
+    height, width = image.shape
+    width_step = width // GameMap.WIDTH
+    height_step = height // GameMap.HEIGHT
+    total_count = width_step * height_step
+
+    game_map = np.zeros((GameMap.HEIGHT, GameMap.WIDTH), dtype=np.uint8)
+    for i in range(GameMap.WIDTH):
+        for j in range(GameMap.HEIGHT):
+            curr_width = i * width_step
+            curr_height = j * height_step
+            partition = image[curr_height:curr_height + height_step,
+                              curr_width:curr_width + width_step]
+
+            primary_count = np.count_nonzero(partition == 74)
+            primary_ratio = primary_count / float(total_count)
+            if primary_ratio >= 0.40:
+                game_map[j, i] = GameMapObjects.WALL
+            elif primary_ratio >= 0.25:
+                game_map[j, i] = GameMapObjects.POWER_UP
+            elif primary_ratio >= 0.05:
+                game_map[j, i] = GameMapObjects.PELLET
+    return game_map
+
+
+def reference_get_slice(full_map, pac_pos, radius):
+    """Extracts a shadowed slice of the map, as originally written.
+
+    Args:
+        full_map: Map matrix.
+        pac_pos: Ms. PacMan's position in the matrix.
+        radius: Radius of the slice.
+
+    Returns:
+        Slice matrix.
+    """
+    height, width = full_map.shape
+    min_i = pac_pos[0] - radius
+    max_i = pac_pos[0] + radius + 1
+    min_j = pac_pos[1] - radius
+    max_j = pac_pos[1] + radius + 1
+
+    vertical_slice = slice(max(min_i, 0), min(max_i, height))
+    horizontal_slice = slice(max(min_j, 0), min(max_j, width))
+    map_slice = full_map[vertical_slice, horizontal_slice]
+
+    # Concatenate the opposite side of the board for a horizontal overflow.
+    if min_j < 0:
+        map_slice = np.hstack((full_map[vertical_slice, min_j - 1:-1],
+                               map_slice))
+    elif max_j >= width:
+        map_slice = np.hstack((map_slice,
+                               full_map[vertical_slice, 0:max_j - width]))
+
+    # Concatenate walls for any vertical overflow.
+    slice_width = map_slice.shape[1]
+    if min_i < 0:
+        map_slice = np.vstack((np.ones((abs(min_i), slice_width),
+                                       dtype=np.uint8),
+                               map_slice))
+    elif max_i >= height:
+        map_slice = np.vstack((map_slice,
+                               np.ones((max_i - height, slice_width),
+                                       dtype=np.uint8)))
+
+    return reference_hide_cells_behind_wall(map_slice)
+
+
+def reference_hide_cells_behind_wall(map_slice):
+    """Hides the cells Ms. PacMan cannot reach, as originally written.
+
+    Args:
+        map_slice: Map slice matrix.
+
+    Returns:
+        Map slice with cells that cannot be reached turned into walls.
+    """
+    height, width = map_slice.shape
+    center = (height - 1) // 2
+
+    # One is the same as GameMapObjects.WALL.
+    shadowed_map = np.ones((height, width))
+    visited = np.zeros((height, width))
+    neighbor_queue = deque()
+    neighbor_queue.append((center, center))
+
+    while neighbor_queue:
+        cell = neighbor_queue.popleft()
+        visited[cell] = 1
+        shadowed_map[cell] = map_slice[cell]
+        if map_slice[cell] == GameMapObjects.WALL:
+            continue
+        for neighbor in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+            i = cell[0] + neighbor[0]
+            j = cell[1] + neighbor[1]
+            if 0 <= i < height and 0 <= j < width and not visited[(i, j)]:
+                neighbor_queue.append((i, j))
+
+    return shadowed_map
+
+
+def reference_get_state(game_map):
+    """Encodes a 5 x 5 slice as dense features, as originally written.
+
+    Args:
+        game_map: Map slice matrix.
+
+    Returns:
+        List of 125 features, one per (object class, cell) pair.
+    """
+    all_state = game_map.flatten()
+    size = len(all_state)
+
+    total_state = [0] * (5 * size)
+
+    for i in range(size):
+        classification = all_state[i]
+        if classification == GameMapObjects.BAD_GHOST:
+            total_state[i] = 1
+        elif classification == GameMapObjects.GOOD_GHOST:
+            total_state[i + size] = 1
+        elif classification == GameMapObjects.PELLET:
+            total_state[i + size * 2] = 1
+        elif classification == GameMapObjects.POWER_UP:
+            total_state[i + size * 3] = 1
+        elif classification == GameMapObjects.FRUIT:
+            total_state[i + size * 4] = 1
+
+    return total_state
+
+
+def reference_weight_index(i):
+    """Ties a dense feature to its weight, as originally written."""
+    return [
+        0, 1, 2, 1, 0,
+        1, 3, 4, 3, 1,
+        2, 4, 5, 4, 2,
+        1, 3, 4, 3, 1,
+        0, 1, 2, 1, 0
+    ][i % 25] + int(i / 25) * 6
+
+
+def reference_utility(weights, state):
+    """Scores a 5 x 5 slice, as originally written.
+
+    Args:
+        weights: Weights.
+        state: Map slice matrix.
+
+    Returns:
+        Utility.
+    """
+    state_rewards = reference_get_state(state)
+    utility = 0
+    for i in range(len(state_rewards)):
+        utility += weights[reference_weight_index(i)] * state_rewards[i]
+    return utility
+
+
+# Maps and slices of every fixture played so far, see _play().
+_played = {}
+
+
+def _play(fixture):
+    """Plays the fixture through to capture the maps the agent sees.
+
+    Args:
+        fixture: Fixture loaded by load_fixture().
+
+    Returns:
+        Tuple of (list of maps with entities, N x 5 x 5 matrix of the slices
+        around Ms. PacMan and the predicted slices of her available
+        actions).
+    """
+    key = id(fixture)
+    if key not in _played:
+        random.seed(0)
+        np.random.seed(0)
+        game = MsPacManGame(0, False, ale=FakeALEInterface(fixture))
+        agent = _RegressionLearner()
+        maps = []
+        slices = []
+        while not game.game_over():
+            maps.append(game.map.map.copy())
+            slices.append(game.sliced_map.map.copy())
+            actions = game.available_actions()
+            if actions:
+                slices.extend(get_next_states(game, actions))
+            game.act(agent.get_optimal_action(game)[0])
+        _played[key] = maps, np.array(slices)
+    return _played[key]
+
+
+def _diff_maps(label, game_map, expected):
+    """Describes the cells of a map that differ from the expected ones.
+
+    Args:
+        label: Description of the map.
+        game_map: Map matrix.
+        expected: Expected map matrix.
+
+    Returns:
+        List of differences.
+    """
+    return [
+        "{} cell {}: {} instead of {}".format(label, (i, j), game_map[i, j],
+                                              expected[i, j])
+        for i, j in np.argwhere(game_map != expected).tolist()
+    ]
+
+
+def check_classify(fixture):
+    """Compares the classification of every screen with the original one.
+
+    Returns:
+        Tuple of (number of screens, list of differences).
+    """
+    screens = fixture["screens"]
+    differences = []
+    for k, screen in enumerate(screens):
+        expected = reference_classify(screen)
+        game_map = GameMap(screen).map
+        differences.extend(_diff_maps("screen {}".format(k), game_map,
+                                      expected))
+    return len(screens), differences
+
+
+def check_classify_cached(fixture):
+    """Compares cached classifications with the original one.
+
+    The wall layout cache restores the walls sprites hide, so only the
+    cells off the cached walls must match.
+
+    Returns:
+        Tuple of (number of screens, list of differences).
+    """
+    screens = fixture["screens"]
+    wall_cache = WallLayoutCache()
+    differences = []
+    for k, screen in enumerate(screens):
+        game_map = GameMap(screen, wall_cache=wall_cache).map
+        expected = np.where(wall_cache.current, GameMapObjects.WALL,
+                            reference_classify(screen))
+        differences.extend(_diff_maps("screen {}".format(k), game_map,
+                                      expected))
+    return len(screens), differences
+
+
+def check_slice(fixture):
+    """Compares the slices of every position with the original ones.
+
+    Every map of the fixture is sliced around every position within it and
+    a few positions just off it, one at a time and all at once, with each
+    radius of RADII.
+
+    Returns:
+        Tuple of (number of slices, list of differences).
+    """
+    maps, _ = _play(fixture)
+    height, width = maps[0].shape
+    centers = [(i, j) for i in range(height) for j in range(width)]
+    outside_centers = [(-1, 0), (height, width - 1), (height // 2, -1),
+                       (height // 2, width)]
+
+    count = 0
+    differences = []
+    for radius in RADII:
+        for k, full_map in enumerate(maps):
+            game_map = GameMap.from_map(full_map)
+            map_slices = get_slices(game_map, centers, radius)
+            for center, batch_slice in zip(centers + outside_centers,
+                                           list(map_slices) + [None] * 4):
+                expected = reference_get_slice(full_map, center, radius)
+                map_slice = get_slice(game_map, center, radius)
+                count += 1
+                if not np.array_equal(map_slice, expected):
+                    differences.append(
+                        "radius {} map {} center {}: {} instead of {}".format(
+                            radius, k, center, map_slice.tolist(),
+                            expected.astype(np.uint8).tolist()))
+                elif (batch_slice is not None and
+                        not np.array_equal(batch_slice, expected)):
+                    differences.append(
+                        "radius {} map {} center {}: {} at once instead of "
+                        "{}".format(radius, k, center, batch_slice.tolist(),
+                                    expected.astype(np.uint8).tolist()))
+    return count, differences
+
+
+def check_features(fixture):
+    """Compares the sparse features and utilities with the dense ones.
+
+    Besides the slices of the fixture, this covers a slice of every object
+    class, including Ms. PacMan's, which has no features.
+
+    Returns:
+        Tuple of (number of slices, list of differences).
+    """
+    every_class = (np.arange(25) % (GameMapObjects.MS_PACMAN + 1)).reshape(
+        5, 5).astype(np.uint8)
+    _, slices = _play(fixture)
+    states = np.concatenate([slices, every_class[np.newaxis]])
+
+    agent = _RegressionLearner()
+    agent.weights = np.random.RandomState(0).uniform(-100, 100,
+                                                     len(agent.weights))
+    agent.weights_version += 1
+    utilities = agent.get_state_utilities(states)
+
+    differences = []
+    for k, state in enumerate(states):
+        expected_features = np.flatnonzero(reference_get_state(state))
+        features = agent._get_state(state)
+        if not np.array_equal(features, expected_features):
+            differences.append("slice {}: features {} instead of {}".format(
+                k, features.tolist(), expected_features.tolist()))
+            continue
+
+        expected_utility = reference_utility(agent.weights, state)
+        for utility in (agent._get_utility(state), utilities[k]):
+            if utility != expected_utility:
+                differences.append("slice {}: utility {!r} instead of "
+                                   "{!r}".format(k, utility,
+                                                 expected_utility))
+    return len(states), differences
+
+
+CHECKS = [
+    ("classify", check_classify),
+    ("classify_cached", check_classify_cached),
+    ("slice", check_slice),
+    ("features", check_features)
+]
+
+
+def get_args():
+    """Gets parsed command-line arguments.
+
+    Returns:
+        Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="checks the optimized code against the original "
+                    "algorithms on recorded frames")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE,
+                        help="fixture to replay")
+    parser.add_argument("--only", nargs="+", default=None,
+                        choices=[name for name, _ in CHECKS],
+                        help="checks to run")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    fixture = load_fixture(args.fixture)
+
+    failed = False
+    for name, check in CHECKS:
+        if args.only and name not in args.only:
+            continue
+        count, differences = check(fixture)
+        print("{:<16} {:>6} checked {:>6} different".format(
+            name, count, len(differences)))
+        for difference in differences[:MAX_REPORTED]:
+            print("    {}".format(difference))
+        failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
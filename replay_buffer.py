@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from transition_model import get_next_states
+
+
+class ReplayBuffer(object):
+
+    """Fixed capacity ring buffer of past transitions.
+
+    Transitions are stored as map slices in preallocated arrays, so memory
+    use only depends on the capacity. Once full, the oldest transitions are
+    overwritten.
+    """
+
+    # Maximum number of next actions of a transition.
+    MAX_ACTIONS = 4
+
+    def __init__(self, capacity, slice_size):
+        """Constructs an empty ReplayBuffer.
+
+        Args:
+            capacity: Maximum number of transitions.
+            slice_size: Size of the map slices.
+        """
+        self.capacity = capacity
+        shape = (capacity, slice_size, slice_size)
+        self.chosen_states = np.zeros(shape, dtype=np.uint8)
+        self.curr_states = np.zeros(shape, dtype=np.uint8)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(
+            (capacity, self.MAX_ACTIONS, slice_size, slice_size),
+            dtype=np.uint8)
+        self.next_available = np.zeros((capacity, self.MAX_ACTIONS),
+                                        dtype=bool)
+
+        self._size = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the buffer's arrays."""
+        return (self.chosen_states.nbytes + self.curr_states.nbytes +
+                self.rewards.nbytes + self.next_states.nbytes +
+                self.next_available.nbytes)
+
+    def add(self, chosen_state, curr_state, reward, next_states):
+        """Adds a transition, overwriting the oldest one when full.
+
+        Args:
+            chosen_state: Predicted slice of the action taken.
+            curr_state: Slice after the action, see
+                Learner.get_current_state().
+            reward: Reward gained by the action.
+            next_states: Predicted slices of the next available actions.
+        """
+        i = self._next
+        self.chosen_states[i] = chosen_state
+        self.curr_states[i] = curr_state
+        self.rewards[i] = reward
+        count = len(next_states)
+        self.next_states[i, :count] = next_states
+        self.next_available[i] = False
+        self.next_available[i, :count] = True
+
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """Samples transitions uniformly with replacement.
+
+        Args:
+            batch_size: Number of transitions.
+
+        Returns:
+            Tuple of (chosen states, current states, rewards, next states,
+            next available) arrays, as expected by
+            Learner.update_weights_batch().
+        """
+        indices = np.random.randint(0, self._size, batch_size)
+        return (self.chosen_states[indices], self.curr_states[indices],
+                self.rewards[indices], self.next_states[indices],
+                self.next_available[indices])
+
+
+class ExperienceReplay(object):
+
+    """Replays past transitions to a learner in mini-batches.
+
+    Every observed step adds a transition to the buffer, and mini-batches are
+    replayed at a fixed average ratio of updates per step once the buffer
+    holds at least one full batch.
+    """
+
+    def __init__(self, agent, capacity=100000, batch_size=32, ratio=1.0):
+        """Constructs an ExperienceReplay.
+
+        Args:
+            agent: Learner to update.
+            capacity: Maximum number of transitions to remember.
+            batch_size: Number of transitions per mini-batch.
+            ratio: Number of mini-batch updates per step, may be
+                fractional.
+        """
+        self.agent = agent
+        self.batch_size = batch_size
+        self.ratio = ratio
+        self.buffer = ReplayBuffer(capacity, 2 * agent.radius + 1)
+        self._credit = 0.0
+
+    def observe(self, prev_state, action, chosen_state, game, reward):
+        """Records a step and replays the mini-batches due.
+
+        Args:
+            prev_state: Map slice the action was taken from.
+            action: Action taken.
+            chosen_state: Predicted slice of the action taken.
+            game: MsPacManGame after the action.
+            reward: Reward gained by the action.
+
+        Returns:
+            Array of the squared errors of the replayed transitions.
+        """
+        curr_state = self.agent.get_current_state(prev_state, action, game)
+        next_actions = game.available_actions()
+        next_states = []
+        if next_actions:
+            next_states = get_next_states(game, next_actions)
+        self.buffer.add(chosen_state, curr_state, reward, next_states)
+
+        if len(self.buffer) < self.batch_size:
+            return np.zeros(0)
+
+        errors = []
+        self._credit += self.ratio
+        while self._credit >= 1:
+            self._credit -= 1
+            errors.append(self.agent.update_weights_batch(
+                *self.buffer.sample(self.batch_size)))
+        return np.concatenate(errors) if errors else np.zeros(0)
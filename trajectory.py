@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import struct
+import numpy as np
+from game_map import GameMap
+from ms_pacman import GameState
+from game_map_objects import EntityState
+
+# File signature and format version.
+MAGIC = b"MSPTRACE"
+VERSION = 1
+
+# Fixed size header: signature, version and length of the JSON metadata.
+_HEADER = struct.Struct("<8sII")
+
+# Alignment of the first record, so that records can be memory-mapped.
+ALIGNMENT = 64
+
+# Flag of the first record of an episode, which holds the initial state
+# rather than the outcome of an action.
+EPISODE_START = 1
+
+
+def get_record_dtype(height, width, slice_size):
+    """Builds the data type of the records of a trace.
+
+    Args:
+        height: Height of the map.
+        width: Width of the map.
+        slice_size: Size of the map slices.
+
+    Returns:
+        Structured NumPy data type.
+    """
+    return np.dtype([
+        ("flags", np.uint8),
+        ("action", np.uint8),
+        ("lives", np.uint8),
+        ("reward", np.int32),
+        ("score", np.int32),
+        ("blank_map", np.uint8, (height, width)),
+        ("map", np.uint8, (height, width)),
+        ("sliced_map", np.uint8, (slice_size, slice_size)),
+        ("entities", EntityState.DTYPE, (EntityState.COUNT,))
+    ])
+
+
+class TraceWriter(object):
+
+    """Appends the decisions of games to a trace file.
+
+    Every record holds the state of the game right after a decision was
+    played, along with the action and reward. The first record of an episode
+    holds its initial state instead.
+    """
+
+    # Number of records to buffer in between writes.
+    BUFFER_SIZE = 256
+
+    def __init__(self, path, slice_size):
+        """Opens a trace file to append to, creating it if needed.
+
+        Args:
+            path: Path of the trace file.
+            slice_size: Size of the map slices.
+
+        Raises:
+            ValueError: If the file is a trace of a different format.
+        """
+        metadata = {
+            "height": GameMap.HEIGHT,
+            "width": GameMap.WIDTH,
+            "slice_size": slice_size
+        }
+        self.dtype = get_record_dtype(GameMap.HEIGHT, GameMap.WIDTH,
+                                      slice_size)
+        self._buffer = np.zeros(self.BUFFER_SIZE, dtype=self.dtype)
+        self._count = 0
+
+        if os.path.isfile(path) and os.path.getsize(path):
+            existing_metadata, offset = _read_header(path)
+            if existing_metadata != metadata:
+                raise ValueError("Trace of a different format: {}"
+                                 .format(path))
+            # Drop any partially written record.
+            size = os.path.getsize(path)
+            records = (size - offset) // self.dtype.itemsize
+            self._file = open(path, "r+b")
+            self._file.truncate(offset + records * self.dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            _write_header(self._file, metadata)
+
+    def start(self, game):
+        """Records the initial state of an episode.
+
+        Args:
+            game: MsPacManGame.
+        """
+        self._append(game, EPISODE_START, 0, 0)
+
+    def step(self, game, action, reward):
+        """Records the outcome of a decision.
+
+        Args:
+            game: MsPacManGame after playing the action.
+            action: Action played.
+            reward: Reward gained.
+        """
+        self._append(game, 0, action, reward)
+
+    def _append(self, game, flags, action, reward):
+        """Buffers a record.
+
+        Args:
+            game: MsPacManGame.
+            flags: Record flags.
+            action: Action played.
+            reward: Reward gained.
+        """
+        record = self._buffer[self._count]
+        record["flags"] = flags
+        record["action"] = action
+        record["lives"] = game.lives
+        record["reward"] = reward
+        record["score"] = game.reward
+        record["blank_map"] = game.blank_map.map
+        record["map"] = game.map.map
+        record["sliced_map"] = game.sliced_map.map
+        record["entities"] = game.entities
+        self._count += 1
+        if self._count == self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records out."""
+        self._file.write(self._buffer[:self._count].tobytes())
+        self._file.flush()
+        self._count = 0
+
+    def close(self):
+        """Writes the buffered records out and closes the file."""
+        self.flush()
+        self._file.close()
+
+
+def _write_header(f, metadata):
+    """Writes the header of a trace file.
+
+    Args:
+        f: File object at the start of the file.
+        metadata: JSON serializable format description.
+    """
+    encoded = json.dumps(metadata, sort_keys=True).encode("utf-8")
+    end = _HEADER.size + len(encoded)
+    offset = -(-end // ALIGNMENT) * ALIGNMENT
+    f.write(_HEADER.pack(MAGIC, VERSION, len(encoded)))
+    f.write(encoded)
+    f.write(b"\0" * (offset - end))
+
+
+def _read_header(path):
+    """Reads the header of a trace file.
+
+    Args:
+        path: Path of the trace file.
+
+    Returns:
+        Tuple of (metadata, offset of the first record).
+
+    Raises:
+        ValueError: If the file is not a trace or of an unknown version.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("Truncated trace: {}".format(path))
+        magic, version, length = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a trace: {}".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported trace version {}: {}"
+                             .format(version, path))
+        metadata = json.loads(f.read(length).decode("utf-8"))
+    end = _HEADER.size + length
+    return metadata, -(-end // ALIGNMENT) * ALIGNMENT
+
+
+def load_trace(path):
+    """Memory-maps the records of a trace file.
+
+    Args:
+        path: Path of the trace file.
+
+    Returns:
+        Read-only structured array of records.
+    """
+    metadata, offset = _read_header(path)
+    dtype = get_record_dtype(metadata["height"], metadata["width"],
+                             metadata["slice_size"])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                     shape=(count,))
+
+
+def to_game_state(record):
+    """Builds the game state of a record.
+
+    Args:
+        record: Trace record.
+
+    Returns:
+        GameState.
+    """
+    return GameState(record["blank_map"], record["map"], record["sliced_map"],
+                     record["entities"], int(record["score"]),
+                     int(record["lives"]))
+
+
+class ReplayGame(object):
+
+    """Replays the decisions of a trace."""
+
+    def __init__(self, records):
+        """Constructs a ReplayGame.
+
+        Args:
+            records: Structured array of trace records.
+        """
+        self._records = records
+
+    def episodes(self):
+        """Iterates over the recorded episodes.
+
+        Yields:
+            Lists of (state, action, reward, next state) transitions, with
+            GameStates before and after each decision.
+        """
+        transitions = []
+        state = None
+        for record in self._records:
+            next_state = to_game_state(record)
+            if record["flags"] & EPISODE_START:
+                if transitions:
+                    yield transitions
+                transitions = []
+            elif state is not None:
+                transitions.append((state, int(record["action"]),
+                                    int(record["reward"]), next_state))
+            state = next_state
+        if transitions:
+            yield transitions
@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from map_proc import get_slice
+import numpy as np
+from map_proc import get_slice, get_slices
 from game_map import GameMap
 from game_map_objects import GameMapObjects, Ghost
 
 
-def get_next_state(game, action):
-    move = game.action_to_move(action)
-    new_pos = game.get_next_position(game.ms_pacman_position, move)
-    game_map = GameMap.from_map(game._blank_map.map.copy())
+def _get_next_map(game, new_pos):
+    """Simulates where the fruit and ghosts will be after one move.
+
+    Args:
+        game: MsPacManGame.
+        new_pos: Ms. PacMan's next position, or None if no ghost is there.
+
+    Returns:
+        GameMap.
+    """
+    game_map = GameMap.from_map(game.blank_map.map.copy())
     if game.fruit.exists:
         game_map.map[game.fruit.position] = GameMapObjects.FRUIT
     for ghost in game.ghosts:
@@ -27,4 +35,44 @@ def get_next_state(game, action):
             game_map.map[new_ghost_position] = GameMapObjects.GOOD_GHOST
         elif ghost.state == Ghost.BAD:
             game_map.map[new_ghost_position] = GameMapObjects.BAD_GHOST
-    return get_slice(game_map, new_pos, 2)
+    return game_map
+
+
+def get_next_state(game, action):
+    return get_next_states(game, [action])[0]
+
+
+def get_next_states(game, actions):
+    """Simulates the sliced maps resulting from several actions at once.
+
+    Args:
+        game: MsPacManGame.
+        actions: Sequence of A actions.
+
+    Returns:
+        A x (2 * radius + 1) x (2 * radius + 1) matrix of sliced maps, of
+        the radius of the game's slices.
+    """
+    radius = game.sliced_map.radius
+    size = 2 * radius + 1
+    next_states = np.empty((len(actions), size, size), dtype=np.uint8)
+
+    # Ghosts only move differently when Ms. PacMan moves onto them, so every
+    # other action shares the same map.
+    ghost_positions = set(ghost.position for ghost in game.ghosts)
+    shared_actions = []
+    shared_positions = []
+    for k, action in enumerate(actions):
+        move = game.action_to_move(action)
+        new_pos = game.get_next_position(game.ms_pacman_position, move)
+        if new_pos in ghost_positions:
+            next_states[k] = get_slice(_get_next_map(game, new_pos), new_pos,
+                                       radius)
+        else:
+            shared_actions.append(k)
+            shared_positions.append(new_pos)
+
+    if shared_actions:
+        next_states[shared_actions] = get_slices(_get_next_map(game, None),
+                                                 shared_positions, radius)
+    return next_states
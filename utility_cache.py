@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+
+class UtilityCache(object):
+
+    """Bounded least recently used cache of state utilities.
+
+    Utilities are only valid for the weights they were computed with, so
+    every lookup carries the version of the weights and the cache empties
+    itself whenever that version changes.
+    """
+
+    def __init__(self, size):
+        """Constructs a UtilityCache.
+
+        Args:
+            size: Maximum number of utilities to hold.
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._utilities = OrderedDict()
+
+    def __len__(self):
+        return len(self._utilities)
+
+    def _validate(self, version):
+        """Empties the cache if the weights changed.
+
+        Args:
+            version: Version of the weights.
+        """
+        if version != self._version:
+            if self._utilities:
+                self.invalidations += 1
+                self._utilities.clear()
+            self._version = version
+
+    def get(self, key, version):
+        """Looks up the utility of a state.
+
+        Args:
+            key: Raw bytes of the state.
+            version: Version of the weights.
+
+        Returns:
+            Utility, or None if not cached.
+        """
+        self._validate(version)
+        utility = self._utilities.pop(key, None)
+        if utility is None:
+            self.misses += 1
+            return None
+
+        # Reinsert to mark it as the most recently used.
+        self._utilities[key] = utility
+        self.hits += 1
+        return utility
+
+    def put(self, key, version, utility):
+        """Caches the utility of a state.
+
+        Args:
+            key: Raw bytes of the state.
+            version: Version of the weights the utility was computed with.
+            utility: Utility.
+        """
+        self._validate(version)
+        self._utilities[key] = utility
+        if len(self._utilities) > self.size:
+            self._utilities.popitem(last=False)
+            self.evictions += 1
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return ("Utility cache: {} hits, {} misses ({:.1f}% hit rate), "
+                "{} evictions, {} invalidations, {}/{} entries").format(
+                    self.hits, self.misses, hit_rate, self.evictions,
+                    self.invalidations, len(self), self.size)